@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Benchmark /api/v1/chat and /api/v1/hackrx/run against local stand-ins for
+Discovery Engine (an HTTP server) and Gemini (a fake model), so runs are
+reproducible on any machine without Google credentials or network access.
+
+Reports throughput and p50/p95/p99 latency per scenario and saves the results
+as JSON. Pass --baseline with an earlier results file to flag regressions.
+
+Usage:
+    python benchmark.py --concurrency 20 --requests 200
+    python benchmark.py --search-latency-ms 300 --search-error-rate 0.02 --baseline old.json
+"""
+
+import os
+import sys
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=["chat", "hackrx", "mixed", "all"], default="all",
+                        help="mixed runs chat and hackrx traffic at the same time (not part of all)")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests per scenario")
+    parser.add_argument("--questions", type=int, default=5, help="questions per /hackrx/run request")
+    parser.add_argument("--stream-answers", action="store_true",
+                        help="request /hackrx/run answers as NDJSON and report time to first answer")
+    parser.add_argument("--search-latency-ms", type=float, default=200, help="median Discovery Engine latency")
+    parser.add_argument("--search-sigma", type=float, default=0.5, help="log-normal spread of search latency")
+    parser.add_argument("--search-error-rate", type=float, default=0.0, help="fraction of searches answered 503")
+    parser.add_argument("--extractive-rate", type=float, default=0.0,
+                        help="fraction of searches returning a high-scoring extractive segment")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300, help="median Gemini latency")
+    parser.add_argument("--gemini-sigma", type=float, default=0.3, help="log-normal spread of Gemini latency")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0, help="fraction of generations failing with 503")
+    parser.add_argument("--repeat-queries", action="store_true",
+                        help="reuse a small set of queries so caches and coalescing take effect")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--standin-port", type=int, default=9200)
+    parser.add_argument("--service-port", type=int, default=9201)
+    parser.add_argument("--output", help="results file (default: benchmark-results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="fail when p95 latency or throughput is worse than baseline by this fraction")
+    return parser.parse_args(argv)
+
+
+ARGS = parse_args()
+API_KEY = "benchmark-key"
+
+# Point the service at the stand-ins before it is imported
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("GOOGLE_PROJECT_ID", "benchmark-project")
+os.environ.setdefault("DISCOVERY_ENGINE_ID", "benchmark-engine")
+os.environ["DISCOVERY_ENDPOINT_URL"] = f"http://127.0.0.1:{ARGS.standin_port}/search"
+os.environ["API_SERVICE_KEY"] = API_KEY
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+if not ARGS.repeat_queries:
+    # Unique queries would only fill the caches, so measure the uncached path
+    os.environ["ANSWER_CACHE_ENABLED"] = "False"
+    os.environ["SEMANTIC_CACHE_ENABLED"] = "False"
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+
+class LatencyModel:
+    """Log-normal latency around a median, plus an independent error rate"""
+
+    def __init__(self, median_ms: float, sigma: float, error_rate: float, rng: random.Random):
+        self.median = median_ms / 1000
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.rng = rng
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * self.rng.lognormvariate(0, self.sigma) if self.sigma > 0 else self.median
+
+    def fails(self) -> bool:
+        return self.rng.random() < self.error_rate
+
+
+def create_discovery_standin(latency: LatencyModel, extractive_rate: float = 0.0) -> FastAPI:
+    """Discovery Engine search endpoint with sampled latency and 503s"""
+    standin = FastAPI()
+
+    @standin.post("/search")
+    async def search(payload: dict):
+        await asyncio.sleep(latency.sample())
+        if latency.fails():
+            return JSONResponse({"error": {"code": 503, "status": "UNAVAILABLE"}}, status_code=503)
+        query = payload.get("query", "")
+        document = {"id": "doc-1"}
+        if latency.rng.random() < extractive_rate:
+            # A scored segment that quotes the question, so the service can skip Gemini
+            document["derivedStructData"] = {"extractive_segments": [
+                {"content": f"On {query.rstrip('?')}: the grace period is thirty days.", "relevanceScore": 0.95}
+            ]}
+        return {
+            "results": [{"id": "doc-1", "document": document}],
+            "summary": {"summaryText": f"Policy excerpt relevant to '{query}': the grace period is thirty days."}
+        }
+
+    return standin
+
+
+_BATCH_QUESTION = re.compile(r"^(\d+)\. \(context C\d+\)", re.MULTILINE)
+
+
+class FakeGeminiUnavailable(Exception):
+    """Mimics a Gemini 503 so the service's retry path is exercised"""
+    code = 503
+
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Blocking generate_content with sampled latency, like the real SDK"""
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+
+    def generate_content(self, prompt, stream=False, generation_config=None, **kwargs):
+        time.sleep(self.latency.sample())
+        if self.latency.fails():
+            raise FakeGeminiUnavailable("503 The model is overloaded")
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            # Batched JSON mode: answer every question listed as "<n>. (context C<m>) ..."
+            indexes = [int(match.group(1)) for match in _BATCH_QUESTION.finditer(prompt)]
+            text = json.dumps({"answers": [{"index": i, "answer": "The grace period is thirty days."}
+                                           for i in indexes]})
+        else:
+            text = "The grace period is thirty days."
+        if stream:
+            return iter([FakeGeminiResponse(word + " ") for word in text.split()])
+        return FakeGeminiResponse(text)
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, degraded, elapsed, shed=0, first_answers=None):
+    ordered = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    summary = {
+        "requests": len(latencies) + errors + shed,
+        "errors": errors,
+        # Rejected early by admission control (429/503), not failed
+        "shed": shed,
+        "degraded_answers": degraded,
+        "duration_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": to_ms(sum(ordered) / len(ordered)) if ordered else None,
+            "p50": to_ms(percentile(ordered, 0.50)),
+            "p95": to_ms(percentile(ordered, 0.95)),
+            "p99": to_ms(percentile(ordered, 0.99)),
+            "max": to_ms(ordered[-1] if ordered else None),
+        },
+    }
+    if first_answers:
+        first = sorted(first_answers)
+        summary["first_answer_ms"] = {
+            "p50": to_ms(percentile(first, 0.50)),
+            "p95": to_ms(percentile(first, 0.95)),
+        }
+    return summary
+
+
+async def start_server(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def build_request(scenario, i, args):
+    """(path, JSON body) for request number i of a scenario"""
+    key = i % 10 if args.repeat_queries else i
+    if scenario == "chat":
+        return "/api/v1/chat", {"message": f"What is the grace period for policy {key}?"}
+    return "/api/v1/hackrx/run", {
+        # Not a URL, so answers come from the Discovery Engine stand-in
+        "documents": "benchmark",
+        "questions": [f"Question {q} about policy {key}?" for q in range(args.questions)]
+    }
+
+
+async def run_scenario(client, scenario, args, degraded_markers):
+    base_url = f"http://127.0.0.1:{args.service_port}"
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+
+    stream = scenario == "hackrx" and args.stream_answers
+
+    async def send_streaming(path, body):
+        """(seconds to first answer, answers) of an NDJSON /hackrx/run response"""
+        started = time.perf_counter()
+        first_answer, answers = None, []
+        async with client.stream("POST", base_url + path, params={"stream": "true"},
+                                 headers=headers, json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code, None, answers
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "answer":
+                    if first_answer is None:
+                        first_answer = time.perf_counter() - started
+                    answers.append(event["answer"])
+                elif event["type"] == "error":
+                    return 500, first_answer, answers
+        return response.status_code, first_answer, answers
+
+    async def send(i):
+        path, body = build_request(scenario, i, args)
+        started = time.perf_counter()
+        if stream:
+            status, first_answer, answers = await send_streaming(path, body)
+        else:
+            response = await client.post(base_url + path, headers=headers, json=body)
+            status, first_answer = response.status_code, None
+            if status == 200:
+                payload = response.json()
+                answers = payload.get("answers") or [payload.get("response", "")]
+        elapsed = time.perf_counter() - started
+        if status != 200:
+            return elapsed, status, 0, None
+        return elapsed, status, sum(1 for answer in answers if answer in degraded_markers), first_answer
+
+    for i in range(args.warmup):
+        await send(-1 - i)
+
+    latencies, first_answers, errors, degraded, shed = [], [], 0, 0, 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors, degraded, shed
+        while next_index < args.requests:
+            i = next_index
+            next_index += 1
+            try:
+                elapsed, status, degraded_count, first_answer = await send(i)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            degraded += degraded_count
+            if status == 200:
+                latencies.append(elapsed)
+                if first_answer is not None:
+                    first_answers.append(first_answer)
+            elif status in (429, 503):
+                shed += 1
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(max(1, args.concurrency))])
+    return summarize(latencies, errors, degraded, time.perf_counter() - started, shed, first_answers)
+
+
+def print_summary(scenario, summary):
+    latency = summary["latency_ms"]
+    print(f"🚀 {scenario}: {summary['requests']} requests, {summary['throughput_rps']} rps, "
+          f"p50 {latency['p50']}ms, p95 {latency['p95']}ms, p99 {latency['p99']}ms, "
+          f"{summary['errors']} errors, {summary['shed']} shed, {summary['degraded_answers']} degraded answers")
+    if "first_answer_ms" in summary:
+        first = summary["first_answer_ms"]
+        print(f"   first answer: p50 {first['p50']}ms, p95 {first['p95']}ms")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, max_regression):
+    """Print deltas against a baseline run; returns False on a regression"""
+    ok = True
+    if baseline.get("config") != results["config"]:
+        print("⚠️ Baseline was run with different settings; deltas may not be comparable")
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        print(f"📊 {scenario} vs baseline ({baseline.get('git_commit') or 'unknown commit'}):")
+        for field in ("p50", "p95", "p99"):
+            before, after = previous["latency_ms"][field], current["latency_ms"][field]
+            if before and after:
+                print(f"   {field}: {before:.1f}ms -> {after:.1f}ms ({(after - before) / before:+.1%})")
+        before, after = previous["throughput_rps"], current["throughput_rps"]
+        if before:
+            print(f"   throughput: {before:.1f} -> {after:.1f} rps ({(after - before) / before:+.1%})")
+
+        p95_before, p95_after = previous["latency_ms"]["p95"], current["latency_ms"]["p95"]
+        if p95_before and p95_after and p95_after > p95_before * (1 + max_regression):
+            print(f"❌ {scenario}: p95 latency regressed by more than {max_regression:.0%}")
+            ok = False
+        if before and after < before * (1 - max_regression):
+            print(f"❌ {scenario}: throughput regressed by more than {max_regression:.0%}")
+            ok = False
+    return ok
+
+
+async def run_benchmark(args):
+    print("🧪 Benchmarking the AI service against local Discovery Engine and Gemini stand-ins")
+    print("=" * 50)
+
+    rng = random.Random(args.seed)
+    search_latency = LatencyModel(args.search_latency_ms, args.search_sigma, args.search_error_rate, rng)
+    gemini_latency = LatencyModel(args.gemini_latency_ms, args.gemini_sigma, args.gemini_error_rate,
+                                  random.Random(args.seed + 1))
+
+    from main import app
+    from routes import api_routes
+    gemini_service = api_routes.init_services()
+    from services.gemini_service import SEARCH_UNAVAILABLE_ANSWER, CHAT_UNAVAILABLE_RESPONSE, CHAT_ERROR_RESPONSE
+
+    async def local_token():
+        return "benchmark-token"
+
+    gemini_service.token_manager.get_token = local_token
+    gemini_service.model = FakeGeminiModel(gemini_latency)
+    degraded_markers = {SEARCH_UNAVAILABLE_ANSWER, CHAT_UNAVAILABLE_RESPONSE, CHAT_ERROR_RESPONSE}
+
+    standin, standin_task = await start_server(create_discovery_standin(search_latency, args.extractive_rate), args.standin_port)
+    service, service_task = await start_server(app, args.service_port)
+
+    scenarios = ["chat", "hackrx"] if args.scenario == "all" else [args.scenario]
+    results = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline", "standin_port", "service_port")},
+        "scenarios": {},
+    }
+    try:
+        limits = httpx.Limits(max_connections=2 * args.concurrency, max_keepalive_connections=2 * args.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+            for scenario in scenarios:
+                if scenario == "mixed":
+                    # Interactive and batch traffic competing for the same upstreams
+                    chat, hackrx = await asyncio.gather(
+                        run_scenario(client, "chat", args, degraded_markers),
+                        run_scenario(client, "hackrx", args, degraded_markers)
+                    )
+                    for name, summary in (("mixed_chat", chat), ("mixed_hackrx", hackrx)):
+                        results["scenarios"][name] = summary
+                        print_summary(name, summary)
+                    continue
+                summary = await run_scenario(client, scenario, args, degraded_markers)
+                results["scenarios"][scenario] = summary
+                print_summary(scenario, summary)
+        results["service_stats"] = {
+            **gemini_service.component_stats(),
+            "admission": api_routes.admission.stats() if api_routes.admission else None
+        }
+    finally:
+        service.should_exit = True
+        standin.should_exit = True
+        await asyncio.gather(service_task, standin_task)
+
+    output = args.output or os.path.join(
+        "benchmark-results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"💾 Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            return compare(results, json.load(f), args.max_regression)
+    return True
+
+
+if __name__ == "__main__":
+    ok = asyncio.run(run_benchmark(ARGS))
+    sys.exit(0 if ok else 1)
@@ -1,8 +1,12 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from routes.api_routes import router as api_router
+from contextlib import asynccontextmanager
 import os
+import math
+import time
+import asyncio
+import logging
 import uvicorn
 from dotenv import load_dotenv
 
@@ -10,11 +14,39 @@ from dotenv import load_dotenv
 load_dotenv('.env.local')  # Load local secrets first
 load_dotenv()  # Load .env as fallback
 
+from services.logging_config import configure_logging, request_id_var, new_request_id
+from services import deadline
+from services.errors import AdmissionRejectedError
+
+# Configure logging before the service is constructed so its startup logs are captured
+configure_logging()
+logger = logging.getLogger(__name__)
+
+from routes import api_routes
+from routes.api_routes import router as api_router
+from services.metrics import HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_IN_FLIGHT
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the service once per worker process and warm it up before the worker
+    # starts accepting requests, so the first request does not pay cold-start costs
+    gemini_service = api_routes.init_services()
+    await gemini_service.start()
+    await api_routes.job_manager.start()
+    try:
+        await asyncio.wait_for(gemini_service.warmup(), float(os.getenv("WARMUP_TIMEOUT_SECONDS", 20)))
+    except asyncio.TimeoutError:
+        logger.warning("Warmup timed out; serving anyway")
+    yield
+    await api_routes.job_manager.stop()
+    await gemini_service.close()
+
 # Create FastAPI app
 app = FastAPI(
     title="HackRx ChatBot AI Service",
     description="AI-powered document processing and chat service using Gemini 2.0 Flash",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -33,6 +65,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class RequestMetricsMiddleware:
+    """Count requests by route/status and track latency and in-flight requests
+    
+    Plain ASGI rather than @app.middleware: call_next returns once the headers are
+    sent, so streamed responses (SSE, NDJSON) are measured until their last chunk.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            # Label by route template (e.g. /api/v1/chat) to keep label cardinality bounded
+            path = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(route=path, method=scope["method"], status=status)
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=path)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+# Default end-to-end budget per route; clients may set their own with X-Request-Timeout-Ms
+ROUTE_DEADLINES = {
+    "/api/v1/chat": float(os.getenv("DEADLINE_CHAT_SECONDS", 15)),
+    "/api/v1/chat/stream": float(os.getenv("DEADLINE_CHAT_STREAM_SECONDS", 30)),
+    "/api/v1/hackrx/run": float(os.getenv("DEADLINE_HACKRX_SECONDS", 120)),
+}
+MAX_DEADLINE_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", 300))
+
+@app.middleware("http")
+async def apply_request_deadline(request: Request, call_next):
+    """Give the request a deadline that searches and generations budget against"""
+    seconds = deadline.parse_timeout_ms(request.headers.get("x-request-timeout-ms"))
+    if seconds is None:
+        seconds = ROUTE_DEADLINES.get(request.url.path)
+    token = deadline.set_deadline(min(seconds, MAX_DEADLINE_SECONDS) if seconds is not None else None)
+    try:
+        return await call_next(request)
+    finally:
+        deadline.reset_deadline(token)
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag every log line of a request with its X-Request-ID (generated if absent)"""
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
 # Include API routes with prefix
 app.include_router(api_router, prefix="/api/v1")
 
@@ -44,27 +143,86 @@ async def root():
         "status": "running",
         "endpoints": {
             "questions": "/api/v1/hackrx/run",
+            "questions_stream": "/api/v1/hackrx/run?stream=true",
             "chat": "/api/v1/chat",
-            "health": "/api/v1/health"
+            "chat_stream": "/api/v1/chat/stream",
+            "jobs": "/api/v1/jobs",
+            "search_cache_invalidate": "/api/v1/admin/search-cache/invalidate",
+            "health": "/api/v1/health",
+            "metrics": "/api/v1/metrics"
         }
     }
 
+@app.exception_handler(AdmissionRejectedError)
+async def admission_rejected_handler(request, exc):
+    """Shed requests fail fast with a hint of when to come back"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "reason": exc.reason, "priority_class": exc.priority_class},
+        headers={"Retry-After": str(int(exc.retry_after))}
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
+    logger.error("Unhandled error on %s %s", request.method, request.url.path,
+                 exc_info=(type(exc), exc, exc.__traceback__))
     return JSONResponse(
         status_code=500,
         content={"detail": f"Internal server error: {str(exc)}"}
     )
 
+def cpu_limit() -> int:
+    """CPUs this process may use: the container's CPU quota (cgroup v2 or v1) or affinity mask
+
+    os.cpu_count() reports the host's CPUs, which inside a container can be far more
+    than the container is allowed to use.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota_files = (("/sys/fs/cgroup/cpu.max", None),
+                   ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"))
+    for quota_path, period_path in quota_files:
+        try:
+            with open(quota_path) as f:
+                fields = f.read().split()
+            if period_path is not None:
+                with open(period_path) as f:
+                    fields.append(f.read().strip())
+        except OSError:
+            continue
+        if fields[0] not in ("max", "-1"):
+            cpus = min(cpus, max(1, math.ceil(int(fields[0]) / int(fields[1]))))
+        break
+    return cpus
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
     host = os.getenv("HOST", "0.0.0.0")
-    debug = os.getenv("DEBUG", "True").lower() == "true"
+    debug = os.getenv("DEBUG", "False").lower() == "true"
+    
+    # Development: one auto-reloading process. Production: up to two worker processes
+    # (override with WORKERS), each building and warming up its own service in the lifespan.
+    # Every worker has its own Gemini pool and rate limiters, so the upstream quotas
+    # (GEMINI_RPM/TPM, DISCOVERY_QPS, GEMINI_MAX_CONCURRENCY) apply per worker
+    workers = 1 if debug else int(os.getenv("WORKERS", min(2, cpu_limit())))
+    # Background jobs last touched before this were cut off by a restart and are resumed
+    # at once; worker processes (re)started later must not take over their siblings' jobs
+    os.environ.setdefault("SERVER_STARTED_AT", str(time.time()))
+    if workers > 1:
+        # Workers share answers through one on-disk cache instead of each starting cold
+        os.environ.setdefault("ANSWER_CACHE_SQLITE_PATH", "answer_cache.db")
+        # Consecutive turns of a chat session may land on different workers
+        os.environ.setdefault("CHAT_SESSION_STORE_PATH", "chat_sessions.db")
+        # An invalidation received by one worker clears every worker's search cache
+        os.environ.setdefault("SEARCH_CACHE_INVALIDATION_FILE", "search_cache.invalidated")
     
     uvicorn.run(
         "main:app",
         host=host,
         port=port,
         reload=debug,
-        log_level="info"
+        workers=workers,
+        log_level=os.getenv("LOG_LEVEL", "INFO").lower()
     )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class QuestionRequest(BaseModel):
     documents: str
@@ -11,7 +11,26 @@ class QuestionResponse(BaseModel):
 class ChatMessage(BaseModel):
     message: str
     timestamp: str = None
+    session_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
     timestamp: str = None
+    session_id: Optional[str] = None
+
+class JobCreatedResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    status_url: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    completed: int
+    answers: List[Optional[str]]
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+    expires_at: Optional[str] = None
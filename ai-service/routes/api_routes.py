@@ -1,13 +1,85 @@
 import os
+import hmac
 from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from contextlib import nullcontext
 from typing import List, Optional
-from models.schemas import QuestionRequest, QuestionResponse, ChatMessage, ChatResponse
+from models.schemas import (
+    QuestionRequest, QuestionResponse, ChatMessage, ChatResponse, JobCreatedResponse, JobStatusResponse
+)
 from services.gemini_service import GeminiService
+from services.job_queue import JobManager, SQLiteJobStore
+from services.chat_sessions import SESSION_ID_PATTERN
+from services.admission import AdmissionController, PriorityClass, INTERACTIVE, BATCH, BACKGROUND
+from services.metrics import REGISTRY
 import asyncio
+import json
+import time
 from datetime import datetime
 
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:  # orjson is optional; the stdlib encoder gives the same lines, just slower
+    def _dumps(data) -> bytes:
+        return json.dumps(data, separators=(",", ":")).encode()
+
 router = APIRouter()
-gemini_service = GeminiService()
+
+# Built once per worker process by init_services() (called from the app lifespan), not at import
+gemini_service: Optional[GeminiService] = None
+job_manager: Optional[JobManager] = None
+admission: Optional[AdmissionController] = None
+
+def init_services() -> GeminiService:
+    """Construct the shared service objects; later calls return the existing ones"""
+    global gemini_service, job_manager, admission
+    if gemini_service is not None:
+        return gemini_service
+    
+    gemini_service = GeminiService()
+    
+    # Chat is admitted first; /hackrx/run and background jobs may only hold part of the
+    # capacity and are shed (429/503 + Retry-After) when their queue is full or too slow
+    if os.getenv("ADMISSION_ENABLED", "True").lower() == "true":
+        # One unit is one question in flight (search + generation); by default 4x the Gemini slots
+        capacity = int(os.getenv("ADMISSION_CAPACITY", 4 * int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))))
+        admission = AdmissionController(capacity, [
+            PriorityClass(
+                INTERACTIVE, 0, capacity,
+                max_queue=int(os.getenv("ADMISSION_INTERACTIVE_MAX_QUEUE", 64)),
+                max_wait=float(os.getenv("ADMISSION_INTERACTIVE_MAX_WAIT_MS", 2000)) / 1000
+            ),
+            PriorityClass(
+                BATCH, 1, int(capacity * float(os.getenv("ADMISSION_BATCH_SHARE", 0.5))),
+                max_queue=int(os.getenv("ADMISSION_BATCH_MAX_QUEUE", 32)),
+                max_wait=float(os.getenv("ADMISSION_BATCH_MAX_WAIT_MS", 15000)) / 1000
+            ),
+            # Jobs already wait in their own queue, so they are never shed here
+            PriorityClass(BACKGROUND, 2, int(capacity * float(os.getenv("ADMISSION_BACKGROUND_SHARE", 0.25))))
+        ])
+    
+    # Background jobs for large question sets; JOB_STORE_PATH="" keeps them in memory only
+    job_store_path = os.getenv("JOB_STORE_PATH", "jobs.db")
+    job_manager = JobManager(
+        gemini_service,
+        store=SQLiteJobStore(job_store_path) if job_store_path else None,
+        workers=int(os.getenv("JOB_WORKERS", 2)),
+        result_ttl=float(os.getenv("JOB_RESULT_TTL_SECONDS", 86400)),
+        max_questions=int(os.getenv("JOB_MAX_QUESTIONS", 500)),
+        lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", 60)),
+        max_pending=int(os.getenv("JOB_MAX_PENDING", 100)),
+        admission=admission,
+        # Set by main.py before the worker processes start, so all of them agree on it
+        started_at=float(os.environ["SERVER_STARTED_AT"]) if os.getenv("SERVER_STARTED_AT") else None
+    )
+    REGISTRY.register_stats(lambda: {
+        **gemini_service.component_stats(),
+        "jobs": job_manager.stats(),
+        "admission": admission.stats() if admission else None
+    })
+    return gemini_service
 
 # Expected API key for authentication
 EXPECTED_API_KEY = os.getenv("API_SERVICE_KEY", "hackrx-secret-key-2024")
@@ -29,30 +101,120 @@ async def verify_api_key(authorization: Optional[str] = Header(None)):
     
     return authorization
 
+async def verify_admin_key(authorization: Optional[str] = Header(None)):
+    """Admin key verification; admin endpoints stay disabled until ADMIN_API_KEY is set"""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_API_KEY is not set)")
+
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Admin authorization required")
+
+    if not hmac.compare_digest(authorization[len("Bearer "):].encode(), admin_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin API key")
+
+    return authorization
+
+def _admit(priority_class: str, cost: int = 1):
+    """Hold admission capacity for the request (raises AdmissionRejectedError when shed)"""
+    return admission.slot(priority_class, cost) if admission is not None else nullcontext()
+
+def _check_session_id(session_id: Optional[str]):
+    if session_id is not None and not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPException(
+            status_code=400, detail="session_id must be 1-128 letters, digits or any of '_', '.', ':', '-'"
+        )
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+def _ndjson_line(data: dict) -> bytes:
+    return _dumps(data) + b"\n"
+
 @router.post("/hackrx/run", response_model=QuestionResponse)
 async def process_questions(
     request: QuestionRequest,
+    stream: bool = False,
+    accept: Optional[str] = Header(None),
     authorization: str = Depends(verify_api_key)
 ):
     """
     Process questions using your trained Discovery Engine and Gemini AI
-    Note: The 'documents' field is ignored as you have pre-trained data in Google Cloud
+    If 'documents' is an http(s) URL (PDF/DOCX/text), that document is indexed locally
+    and used as the context instead of Discovery Engine
+    With ?stream=true or 'Accept: application/x-ndjson' answers are streamed as NDJSON
     """
-    try:
-        if not request.questions:
-            raise HTTPException(status_code=400, detail="At least one question is required")
-        
-        # Process questions using your Discovery Engine + Gemini service
-        # The document_url parameter is not used since you have pre-trained data
-        answers = await gemini_service.answer_questions(
-            document_url="",  # Not used - your data is in Discovery Engine
-            questions=request.questions
-        )
-        
-        return QuestionResponse(answers=answers)
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    # A request holds as many units as questions it works on at once
+    cost = min(len(request.questions), gemini_service.question_concurrency)
+    if stream or (accept and NDJSON_MEDIA_TYPE in accept):
+        return await _stream_answers(request, cost)
+    async with _admit(BATCH, cost):
+        try:
+            if not request.questions:
+                raise HTTPException(status_code=400, detail="At least one question is required")
+            
+            # Process questions using the request's document or your Discovery Engine + Gemini service
+            answers = await gemini_service.answer_questions(
+                document_url=request.documents,
+                questions=request.questions
+            )
+            
+            return QuestionResponse(answers=answers)
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+async def _stream_answers(request: QuestionRequest, cost: int) -> StreamingResponse:
+    """
+    One NDJSON line per answer, in the order answers complete:
+    {"type": "answer", "index": ..., "answer": ..., "elapsed_ms": ...}
+    then a final {"type": "done", ...} line with timings, or {"type": "error", ...}
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="At least one question is required")
+    # Admitted before the response starts, so a shed request still gets a plain 429/503
+    ticket = await admission.acquire(BATCH, cost) if admission is not None else None
+    release = ticket.release if ticket is not None else None
+    
+    async def answer_stream():
+        started = time.perf_counter()
+        first_answer_ms = None
+        answered = 0
+        try:
+            async for index, answer in gemini_service.iter_answers(request.documents, request.questions):
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if first_answer_ms is None:
+                    first_answer_ms = elapsed_ms
+                answered += 1
+                yield _ndjson_line({
+                    "type": "answer", "index": index, "answer": answer, "elapsed_ms": round(elapsed_ms, 2)
+                })
+            
+            yield _ndjson_line({
+                "type": "done",
+                "timestamp": datetime.now().isoformat(),
+                "metadata": {
+                    "questions": len(request.questions),
+                    "answered": answered,
+                    "time_to_first_answer_ms": round(first_answer_ms, 2) if first_answer_ms is not None else None,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2)
+                }
+            })
+        except Exception as e:
+            # The 200 status is already sent; report the failure in-band
+            yield _ndjson_line({
+                "type": "error", "detail": f"Internal server error: {str(e)}", "answered": answered
+            })
+        finally:
+            if release is not None:
+                release()
+    
+    return StreamingResponse(
+        answer_stream(),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also releases the capacity if the stream never started (release is idempotent)
+        background=BackgroundTask(release) if release is not None else None
+    )
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(
@@ -61,32 +223,166 @@ async def chat_endpoint(
 ):
     """
     Chat endpoint that uses your Discovery Engine knowledge base
+    Pass the same session_id on every turn to let earlier turns inform the answer
     """
+    _check_session_id(message.session_id)
+    async with _admit(INTERACTIVE):
+        try:
+            if not message.message.strip():
+                raise HTTPException(status_code=400, detail="Message cannot be empty")
+            
+            # Generate response using Discovery Engine + Gemini service
+            response_text = await gemini_service.chat_response(message.message, message.session_id)
+            
+            return ChatResponse(
+                response=response_text,
+                timestamp=datetime.now().isoformat(),
+                session_id=message.session_id
+            )
+            
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+def _job_status(job: dict) -> JobStatusResponse:
+    def iso(timestamp):
+        return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+    
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        total=len(job["questions"]),
+        completed=sum(1 for answer in job["answers"] if answer is not None),
+        answers=job["answers"],
+        error=job["error"],
+        created_at=iso(job["created_at"]),
+        updated_at=iso(job["updated_at"]),
+        expires_at=iso(job["expires_at"])
+    )
+
+@router.post("/jobs", response_model=JobCreatedResponse, status_code=202)
+async def create_job(
+    request: QuestionRequest,
+    authorization: str = Depends(verify_api_key)
+):
+    """
+    Queue a question set to be answered in the background
+    Poll GET /jobs/{job_id} for progress and (partial) answers
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="At least one question is required")
     try:
-        if not message.message.strip():
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-        
-        # Generate response using Discovery Engine + Gemini service
-        response_text = await gemini_service.chat_response(message.message)
-        
-        return ChatResponse(
-            response=response_text,
-            timestamp=datetime.now().isoformat()
-        )
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+        job = await job_manager.submit(request.documents, request.questions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return JobCreatedResponse(
+        job_id=job["id"],
+        status=job["status"],
+        total=len(job["questions"]),
+        status_url=f"/api/v1/jobs/{job['id']}"
+    )
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(
+    job_id: str,
+    authorization: str = Depends(verify_api_key)
+):
+    """Progress of a background job; answers are null until answered"""
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return _job_status(job)
+
+@router.post("/admin/search-cache/invalidate")
+async def invalidate_search_cache(authorization: str = Depends(verify_admin_key)):
+    """Drop every cached search result, e.g. after the Discovery Engine data store is reindexed"""
+    if gemini_service.search_cache is None:
+        return {"enabled": False, "invalidated": 0}
+    return {"enabled": True, "invalidated": gemini_service.search_cache.invalidate()}
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(
+    message: ChatMessage,
+    authorization: str = Depends(verify_api_key)
+):
+    """
+    Streaming chat endpoint: sends the answer as server-sent events while it is generated
+    Emits 'token' events with text chunks, then a final 'done' event with timing metadata,
+    or an 'error' event (instead of 'done') if the answer could not be completed
+    """
+    if not message.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    _check_session_id(message.session_id)
+    # Admitted before the response starts, so a shed request still gets a plain 429/503
+    ticket = await admission.acquire(INTERACTIVE) if admission is not None else None
+    release = ticket.release if ticket is not None else None
+    
+    async def event_stream():
+        try:
+            started = time.perf_counter()
+            first_token_ms = None
+            chunks = 0
+            characters = 0
+            
+            try:
+                async for text in gemini_service.chat_stream(message.message, message.session_id):
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    chunks += 1
+                    characters += len(text)
+                    yield _sse_event("token", {"text": text})
+            except Exception as e:
+                # The 200 status is already sent; tokens received so far are an incomplete answer
+                yield _sse_event("error", {
+                    "detail": gemini_service.chat_error_message(e),
+                    "reason": getattr(e, "reason", "internal_error"),
+                    "chunks": chunks
+                })
+                return
+            
+            yield _sse_event("done", {
+                "timestamp": datetime.now().isoformat(),
+                "session_id": message.session_id,
+                "metadata": {
+                    "time_to_first_token_ms": round(first_token_ms, 2) if first_token_ms is not None else None,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "chunks": chunks,
+                    "characters": characters
+                }
+            })
+        finally:
+            if release is not None:
+                release()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also releases the capacity if the stream never started (release is idempotent)
+        background=BackgroundTask(release) if release is not None else None
+    )
 
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy", 
+        "status": gemini_service.health_status(),
         "service": "ai-service", 
         "timestamp": datetime.now().isoformat(),
         "discovery_engine": {
             "project_id": gemini_service.project_id,
             "engine_id": gemini_service.engine_id,
             "location": gemini_service.location
-        }
+        },
+        **gemini_service.component_stats(),
+        "jobs": job_manager.stats(),
+        "admission": admission.stats() if admission else None
     }
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
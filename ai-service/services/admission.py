@@ -0,0 +1,207 @@
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional
+
+from services import deadline
+from services.errors import AdmissionRejectedError
+from services.metrics import ADMISSION_QUEUED, ADMISSION_IN_USE, ADMISSION_REJECTIONS, ADMISSION_WAIT_SECONDS
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+
+
+class PriorityClass:
+    """Admission settings of one kind of traffic; lower `priority` is served first"""
+
+    def __init__(self, name: str, priority: int, max_units: int,
+                 max_queue: Optional[int] = None, max_wait: Optional[float] = None):
+        self.name = name
+        self.priority = priority
+        # Most capacity units this class may hold at once, so it cannot crowd out the others
+        self.max_units = max(1, max_units)
+        # None = unbounded queue / wait as long as it takes
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+
+class Ticket:
+    """Capacity held by one admitted request; release() is safe to call more than once"""
+
+    __slots__ = ("controller", "priority_class", "cost", "admitted_at", "released")
+
+    def __init__(self, controller: "AdmissionController", priority_class: str, cost: int):
+        self.controller = controller
+        self.priority_class = priority_class
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class _Waiter:
+    __slots__ = ("future", "cost", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, cost: int):
+        self.future = future
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """Shares a fixed number of capacity units between priority classes
+
+    A request asks for `cost` units of its class. It is admitted at once when the
+    units are free and no higher-priority request is waiting; otherwise it joins its
+    class's bounded queue. Freed units go to the highest-priority waiter first.
+    Requests are rejected early (429 when the queue is full, 503 once `max_wait` or
+    the request's deadline runs out) with a Retry-After estimate, instead of
+    timing out deep inside an upstream call.
+    """
+
+    def __init__(self, capacity: int, classes: List[PriorityClass]):
+        self.capacity = max(1, capacity)
+        self.classes = {c.name: c for c in sorted(classes, key=lambda c: c.priority)}
+        self.in_use = 0
+        self._class_in_use: Dict[str, int] = {name: 0 for name in self.classes}
+        self._queues: Dict[str, Deque[_Waiter]] = {name: deque() for name in self.classes}
+
+        # Counters exposed through stats(), plus a moving average of how long units are held
+        self._admitted: Dict[str, int] = {name: 0 for name in self.classes}
+        self._rejected: Dict[str, Dict[str, int]] = {name: {"queue_full": 0, "wait_timeout": 0}
+                                                     for name in self.classes}
+        self._avg_hold: Dict[str, float] = {name: 1.0 for name in self.classes}
+
+    def _fits(self, cls: PriorityClass, cost: int) -> bool:
+        return self.in_use + cost <= self.capacity and self._class_in_use[cls.name] + cost <= cls.max_units
+
+    def _higher_priority_waiting(self, cls: PriorityClass) -> bool:
+        """Whether a more important request is queued that its own class limit lets in"""
+        for other in self.classes.values():
+            if other.priority >= cls.priority:
+                return False
+            queue = self._queues[other.name]
+            if queue and self._class_in_use[other.name] + queue[0].cost <= other.max_units:
+                return True
+        return False
+
+    def _admit(self, cls: PriorityClass, cost: int) -> Ticket:
+        self.in_use += cost
+        self._class_in_use[cls.name] += cost
+        self._admitted[cls.name] += 1
+        ADMISSION_IN_USE.set(self._class_in_use[cls.name], priority_class=cls.name)
+        return Ticket(self, cls.name, cost)
+
+    def _dispatch(self):
+        """Hand freed units to waiters, highest priority first and FIFO within a class"""
+        for cls in self.classes.values():
+            queue = self._queues[cls.name]
+            while queue:
+                waiter = queue[0]
+                if waiter.future.done():
+                    queue.popleft()
+                    continue
+                if not self._fits(cls, waiter.cost):
+                    break
+                queue.popleft()
+                waiter.future.set_result(self._admit(cls, waiter.cost))
+            ADMISSION_QUEUED.set(len(queue), priority_class=cls.name)
+            # Out of total capacity: lower classes must not overtake this waiter
+            if queue and self.in_use + queue[0].cost > self.capacity:
+                return
+
+    def _release(self, ticket: Ticket):
+        cls = self.classes[ticket.priority_class]
+        self.in_use -= ticket.cost
+        self._class_in_use[cls.name] -= ticket.cost
+        held = time.monotonic() - ticket.admitted_at
+        self._avg_hold[cls.name] = 0.9 * self._avg_hold[cls.name] + 0.1 * held
+        ADMISSION_IN_USE.set(self._class_in_use[cls.name], priority_class=cls.name)
+        self._dispatch()
+
+    def _retry_after(self, cls: PriorityClass, cost: int) -> float:
+        """Rough time until this class's queue drains far enough, in whole seconds"""
+        waiting = len(self._queues[cls.name]) + 1
+        return float(max(1, math.ceil(self._avg_hold[cls.name] * waiting * cost / cls.max_units)))
+
+    def _reject(self, cls: PriorityClass, cost: int, reason: str, status_code: int):
+        self._rejected[cls.name][reason] += 1
+        ADMISSION_REJECTIONS.inc(priority_class=cls.name, reason=reason)
+        raise AdmissionRejectedError(cls.name, reason, status_code, self._retry_after(cls, cost))
+
+    async def acquire(self, priority_class: str, cost: int = 1) -> Ticket:
+        """Wait for `cost` units; raises AdmissionRejectedError when the request is shed"""
+        cls = self.classes[priority_class]
+        cost = max(1, min(cost, cls.max_units, self.capacity))
+        queue = self._queues[cls.name]
+        if not queue and self._fits(cls, cost) and not self._higher_priority_waiting(cls):
+            return self._admit(cls, cost)
+
+        if cls.max_queue is not None and len(queue) >= cls.max_queue:
+            self._reject(cls, cost, "queue_full", 429)
+        wait = cls.max_wait
+        budget = deadline.remaining()
+        if budget is not None:
+            wait = budget if wait is None else min(wait, budget)
+        if wait is not None and wait <= 0:
+            self._reject(cls, cost, "wait_timeout", 503)
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), cost)
+        queue.append(waiter)
+        ADMISSION_QUEUED.set(len(queue), priority_class=cls.name)
+        try:
+            ticket = await asyncio.wait_for(waiter.future, wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted in the same instant the wait ended
+                ticket = waiter.future.result()
+                if isinstance(e, asyncio.CancelledError):
+                    ticket.release()
+                    raise
+            else:
+                waiter.future.cancel()
+                if waiter in queue:
+                    queue.remove(waiter)
+                # The head of the queue may have been what held others back
+                self._dispatch()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject(cls, cost, "wait_timeout", 503)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued_at, priority_class=cls.name)
+        return ticket
+
+    @asynccontextmanager
+    async def slot(self, priority_class: str, cost: int = 1):
+        ticket = await self.acquire(priority_class, cost)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "rejected": sum(sum(reasons.values()) for reasons in self._rejected.values()),
+            "classes": {
+                name: {
+                    "in_use": self._class_in_use[name],
+                    "max_units": cls.max_units,
+                    "queued": len(self._queues[name]),
+                    "max_queue": cls.max_queue,
+                    "max_wait_seconds": cls.max_wait,
+                    "admitted": self._admitted[name],
+                    "rejected": dict(self._rejected[name]),
+                    "avg_hold_seconds": round(self._avg_hold[name], 3),
+                }
+                for name, cls in self.classes.items()
+            },
+        }
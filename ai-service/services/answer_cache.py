@@ -0,0 +1,151 @@
+import re
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?.!,;:]+$")
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def make_cache_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """On-disk cache store so cached answers survive restarts"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answer_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        # Drop entries that expired while the service was down
+        self.purge_expired(time.time())
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM answer_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, key: str, value: str, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answer_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            self._conn.commit()
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM answer_cache WHERE expires_at <= ?", (now,)
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AnswerCache:
+    """Bounded in-process LRU cache with per-entry TTL and an optional backend
+
+    Expired rows are deleted from the backend at most once per `purge_interval`
+    seconds (on a write), so the file does not grow without bound.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, backend: SQLiteCacheBackend = None,
+                 purge_interval: float = 300.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.purge_interval = purge_interval
+        self._next_purge = time.time() + purge_interval
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.purged = 0
+
+    def _store(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expirations += 1
+
+        if self.backend is not None:
+            stored = await asyncio.to_thread(self.backend.get, key)
+            if stored is not None and stored[1] > now:
+                self._store(key, stored[0], stored[1])
+                self.hits += 1
+                self.backend_hits += 1
+                return stored[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self._store(key, value, expires_at)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.set, key, value, expires_at)
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                self.purged += await asyncio.to_thread(self.backend.purge_expired, now)
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "backend": "sqlite" if self.backend is not None else None,
+            "hits": self.hits,
+            "backend_hits": self.backend_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "purged": self.purged,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
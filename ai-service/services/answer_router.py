@@ -0,0 +1,129 @@
+import re
+import time
+from typing import Dict, Optional
+
+from services.search_result import SearchResult
+from services.semantic_cache import tokenize
+from services.metrics import ANSWER_ROUTE_SECONDS
+
+GEMINI = "gemini"
+EXTRACTIVE_SEGMENT = "extractive_segment"
+EXTRACTIVE_ANSWER = "extractive_answer"
+SUMMARY = "summary"
+
+# Questions asking to combine or reason over several facts always go to Gemini
+_SYNTHESIS_MARKERS = re.compile(
+    r"\b(compare|comparison|differences?|versus|vs|why|explain|summari[sz]e|list all|pros and cons|"
+    r"advantages|disadvantages|step by step|calculate)\b",
+    re.IGNORECASE
+)
+_CITATION_MARKERS = re.compile(r"\s*\[\d+(?:\s*,\s*\d+)*\]")
+# Summary text Discovery Engine returns when it could not (or would not) summarize
+_SUMMARY_NOTICES = ("summary could not be generated", "no results could be found")
+
+
+class Route:
+    """Where one question was answered: a direct tier (with its answer) or Gemini"""
+
+    __slots__ = ("tier", "answer", "started")
+
+    def __init__(self, tier: str, answer: Optional[str] = None):
+        self.tier = tier
+        self.answer = answer
+        self.started = 0.0
+
+    @property
+    def direct(self) -> bool:
+        return self.answer is not None
+
+
+class AnswerRouter:
+    """Answers straight from a search result when it already answers the question
+
+    Tiers are tried in order: the top extractive segment (scored by Discovery
+    Engine), the top result's extractive answer, then the cited summary. A
+    candidate must cover `min_term_coverage` of the question's content words and
+    be at most `max_chars` long; anything else, and any question that asks for
+    synthesis (compare, explain, ...), is routed to Gemini.
+    """
+
+    def __init__(self, segment_min_score: float = 0.9, min_term_coverage: float = 0.6,
+                 max_chars: int = 1200, use_summary: bool = True):
+        self.segment_min_score = segment_min_score
+        self.min_term_coverage = min_term_coverage
+        self.max_chars = max_chars
+        self.use_summary = use_summary
+
+        # Counters exposed through stats(): decisions and answer latency per route
+        self.routes: Dict[str, int] = {GEMINI: 0, EXTRACTIVE_SEGMENT: 0, EXTRACTIVE_ANSWER: 0, SUMMARY: 0}
+        self.seconds: Dict[str, float] = {GEMINI: 0.0, "direct": 0.0}
+        self.timed: Dict[str, int] = {GEMINI: 0, "direct": 0}
+
+    def _covers(self, question_terms: set, text: str) -> bool:
+        if not question_terms:
+            return False
+        covered = question_terms.intersection(tokenize(text))
+        return len(covered) / len(question_terms) >= self.min_term_coverage
+
+    def _candidate(self, question_terms: set, text: str) -> Optional[str]:
+        text = _CITATION_MARKERS.sub("", text).strip()
+        if text and len(text) <= self.max_chars and self._covers(question_terms, text):
+            return text
+        return None
+
+    def _direct_answer(self, question: str, result: SearchResult) -> Optional[Route]:
+        if not result or _SYNTHESIS_MARKERS.search(question) or question.count("?") > 1:
+            return None
+        question_terms = set(tokenize(question))
+
+        for passage in result.passages:
+            if passage.kind == EXTRACTIVE_SEGMENT and passage.score >= self.segment_min_score:
+                answer = self._candidate(question_terms, passage.text)
+                if answer:
+                    return Route(EXTRACTIVE_SEGMENT, answer)
+        for passage in result.passages:
+            if passage.kind == EXTRACTIVE_ANSWER and passage.rank == 0:
+                answer = self._candidate(question_terms, passage.text)
+                if answer:
+                    return Route(EXTRACTIVE_ANSWER, answer)
+
+        # Only a summary grounded in cited documents is trusted on its own
+        summary = result.summary
+        if self.use_summary and summary and result.citations and \
+                not any(notice in summary.lower() for notice in _SUMMARY_NOTICES):
+            answer = self._candidate(question_terms, summary)
+            if answer:
+                return Route(SUMMARY, answer)
+        return None
+
+    def route(self, question: str, result: SearchResult, started: float) -> Route:
+        """Pick the route for a question whose handling began at `started` (perf_counter)
+
+        Route.answer is set when Gemini can be skipped.
+        """
+        route = self._direct_answer(question, result) or Route(GEMINI)
+        route.started = started
+        self.routes[route.tier] += 1
+        return route
+
+    def finish(self, route: Route):
+        """Record how long the question took end to end on its route"""
+        elapsed = time.perf_counter() - route.started
+        ANSWER_ROUTE_SECONDS.observe(elapsed, route=route.tier)
+        bucket = "direct" if route.direct else GEMINI
+        self.seconds[bucket] += elapsed
+        self.timed[bucket] += 1
+
+    def stats(self) -> dict:
+        routed = sum(self.routes.values())
+        direct = routed - self.routes[GEMINI]
+        return {
+            "routed": routed,
+            "direct": direct,
+            "direct_ratio": round(direct / routed, 4) if routed else 0.0,
+            "routes": dict(self.routes),
+            "avg_direct_ms": round(self.seconds["direct"] / self.timed["direct"] * 1000, 1)
+            if self.timed["direct"] else 0.0,
+            "avg_gemini_ms": round(self.seconds[GEMINI] / self.timed[GEMINI] * 1000, 1)
+            if self.timed[GEMINI] else 0.0,
+        }
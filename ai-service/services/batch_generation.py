@@ -0,0 +1,53 @@
+import re
+import json
+from typing import Dict, List, Tuple
+
+from services.prompt_builder import BATCH_TEMPLATE
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+
+
+def build_batch_prompt(items: List[Tuple[int, str, str]]) -> str:
+    """Build one prompt answering several (index, question, context) items as JSON
+
+    Contexts should already be budgeted (PromptBuilder.compress); identical ones
+    are included once and referenced by ID.
+    """
+    context_ids: Dict[str, str] = {}
+    context_blocks = []
+    question_lines = []
+    for index, question, context in items:
+        context_id = context_ids.get(context)
+        if context_id is None:
+            context_id = f"C{len(context_ids) + 1}"
+            context_ids[context] = context_id
+            context_blocks.append(f"[{context_id}]\n{context}")
+        question_lines.append(f"{index}. (context {context_id}) {question}")
+
+    return BATCH_TEMPLATE.format(contexts="\n\n".join(context_blocks), questions="\n".join(question_lines))
+
+
+def parse_batch_answers(text: str, expected_indexes: List[int]) -> Dict[int, str]:
+    """Return the valid answers keyed by question index; anything malformed is dropped"""
+    try:
+        data = json.loads(_CODE_FENCE.sub("", text.strip()))
+    except (TypeError, ValueError):
+        return {}
+
+    entries = data.get("answers") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return {}
+
+    expected = set(expected_indexes)
+    answers = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        index = entry.get("index")
+        answer = entry.get("answer")
+        if isinstance(index, str) and index.strip().isdigit():
+            index = int(index)
+        if isinstance(index, int) and index in expected and index not in answers and \
+           isinstance(answer, str) and answer.strip():
+            answers[index] = answer.strip()
+    return answers
@@ -0,0 +1,238 @@
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from services.semantic_cache import HashingVectorizer, key_terms, tokenize
+from services.prompt_builder import estimate_tokens
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+# Messages that lean on the previous turn ("and for children?", "does that apply ...")
+_FOLLOW_UP_START = re.compile(r"^\s*(and|also|what about|how about|what if|same for)\b", re.IGNORECASE)
+_REFERRING_WORDS = re.compile(r"\b(it|its|that|this|they|them|those|these|there|he|she)\b", re.IGNORECASE)
+
+# Reuse  -> answer from the previous turn's passages without searching (only for a
+#           rewording of the previous query that adds no content terms of its own)
+# Rewrite -> search again with the previous query prepended to the message
+# Search  -> a new topic: search for the message alone
+REUSE, REWRITE, SEARCH = "reuse", "rewrite", "search"
+
+_COLUMNS = ("id", "summary", "turns", "topic", "context", "updated_at")
+
+
+class ChatSession:
+    """One conversation: a running summary, the recent turns and the last retrieval"""
+
+    __slots__ = ("session_id", "summary", "turns", "topic", "context", "updated_at", "summarizing")
+
+    def __init__(self, session_id: str, summary: str = "", turns: List[Tuple[str, str]] = None,
+                 topic: str = "", context: str = "", updated_at: float = 0.0):
+        self.session_id = session_id
+        self.summary = summary
+        self.turns = turns or []
+        # The query and context of the last search, reused by follow-ups on the same topic
+        self.topic = topic
+        self.context = context
+        self.updated_at = updated_at
+        self.summarizing = False
+
+    @property
+    def has_history(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def add_turn(self, message: str, response: str):
+        self.turns.append((message, response))
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    return "\n".join(f"User: {message}\nAssistant: {response}" for message, response in turns)
+
+
+def history_text(session: ChatSession, token_budget: int) -> str:
+    """The summary plus as many of the newest turns as fit in token_budget"""
+    blocks = []
+    used = 0
+    for message, response in reversed(session.turns):
+        block = format_turns([(message, response)])
+        cost = estimate_tokens(block)
+        if blocks and used + cost > token_budget:
+            break
+        if not blocks and cost > token_budget:
+            # A single very long turn: keep its start so the thread is still visible
+            block = block[:max(0, token_budget) * 4]
+            cost = token_budget
+        blocks.append(block)
+        used += cost
+    parts = [f"Summary of earlier conversation: {session.summary}"] if session.summary else []
+    parts.extend(reversed(blocks))
+    return "\n".join(parts)
+
+
+def fold_turns(summary: str, turns: List[Tuple[str, str]], token_budget: int) -> str:
+    """Cheap summary update without Gemini: note what was asked, newest kept if over budget"""
+    text = " ".join([summary] + [f"The user asked: {message}" for message, _ in turns]).strip()
+    limit = max(0, token_budget) * 4
+    return text if len(text) <= limit else text[-limit:].split(" ", 1)[-1]
+
+
+class SQLiteSessionStore:
+    """Keeps chat sessions in a local SQLite file, shared by worker processes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_sessions ("
+                "id TEXT PRIMARY KEY, summary TEXT NOT NULL, turns TEXT NOT NULL, "
+                "topic TEXT NOT NULL, context TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def save(self, session: ChatSession):
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO chat_sessions ({', '.join(_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)",
+                (session.session_id, session.summary, json.dumps(session.turns),
+                 session.topic, session.context, session.updated_at)
+            )
+            self._conn.commit()
+
+    def load(self, session_id: str, newer_than: float = 0.0) -> Optional[ChatSession]:
+        """The stored session, or None if it is missing or not newer than newer_than"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM chat_sessions WHERE id = ? AND updated_at > ?",
+                (session_id, newer_than)
+            ).fetchone()
+        if row is None:
+            return None
+        session_id, summary, turns, topic, context, updated_at = row
+        return ChatSession(session_id, summary, [tuple(turn) for turn in json.loads(turns)],
+                           topic, context, updated_at)
+
+    def purge_expired(self, before: float) -> int:
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM chat_sessions WHERE updated_at <= ?", (before,)
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ChatSessionStore:
+    """LRU of chat sessions with an idle TTL and an optional SQLite backend
+
+    Sessions are written through to the backend after every turn, so one evicted
+    from memory (or last updated by another worker process) is loaded back from
+    it. Without a backend an evicted session starts over.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: float, topic_threshold: float = 0.75,
+                 backend: SQLiteSessionStore = None, dim: int = 512):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_seconds = ttl_seconds
+        self.topic_threshold = topic_threshold
+        self.backend = backend
+        self.vectorizer = HashingVectorizer(dim)
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        if backend is not None:
+            backend.purge_expired(time.time() - ttl_seconds)
+
+        # Counters exposed through stats()
+        self.created = 0
+        self.backend_loads = 0
+        self.evictions = 0
+        self.turns = 0
+        self.retrievals = {REUSE: 0, REWRITE: 0, SEARCH: 0}
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def _remember(self, session: ChatSession):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, session_id: str) -> ChatSession:
+        """The live session for session_id, starting a new one if it is unknown or idle too long"""
+        now = time.time()
+        session = self._sessions.get(session_id)
+        if session is not None and session.updated_at <= now - self.ttl_seconds:
+            del self._sessions[session_id]
+            session = None
+
+        if self.backend is not None:
+            # Another worker may have handled a later turn of this session
+            newer_than = session.updated_at if session is not None else now - self.ttl_seconds
+            stored = await asyncio.to_thread(self.backend.load, session_id, newer_than)
+            if stored is not None:
+                session = stored
+                self.backend_loads += 1
+
+        if session is None:
+            session = ChatSession(session_id, updated_at=now)
+            self.created += 1
+        self._remember(session)
+        return session
+
+    async def save(self, session: ChatSession):
+        session.updated_at = time.time()
+        self._remember(session)
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.save, session)
+
+    async def record_turn(self, session: ChatSession, message: str, response: str):
+        session.add_turn(message, response)
+        self.turns += 1
+        await self.save(session)
+
+    def retrieval_plan(self, session: ChatSession, message: str) -> Tuple[str, str]:
+        """How to get context for a message: (REUSE | REWRITE | SEARCH, search query)"""
+        if not session.context or not session.topic:
+            plan = (SEARCH, message)
+        else:
+            # Shared generic words ("waiting period") are not enough: any new content term
+            # ("cataract", "Plan B") means the previous passages may not cover the message
+            similarity = float(self.vectorizer.embed(message) @ self.vectorizer.embed(session.topic))
+            if similarity >= self.topic_threshold and key_terms(message) <= key_terms(session.topic):
+                plan = (REUSE, session.topic)
+            elif _FOLLOW_UP_START.search(message) or \
+                    (_REFERRING_WORDS.search(message) and len(tokenize(message)) <= 4):
+                # Capped so a chain of follow-ups does not keep growing the query
+                plan = (REWRITE, " ".join(f"{session.topic} {message}".split()[-40:]))
+            else:
+                plan = (SEARCH, message)
+        self.retrievals[plan[0]] += 1
+        return plan
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "ttl_seconds": self.ttl_seconds,
+            "backend": "sqlite" if self.backend is not None else None,
+            "created": self.created,
+            "backend_loads": self.backend_loads,
+            "evictions": self.evictions,
+            "turns": self.turns,
+            "retrievals": dict(self.retrievals),
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+        }
@@ -0,0 +1,127 @@
+import time
+import logging
+from typing import Any, Awaitable, Callable
+
+from services.errors import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures and probes it again later
+
+    closed: calls go through; `failure_threshold` consecutive failures open the circuit.
+    open: calls fail fast with CircuitOpenError for `recovery_timeout` seconds.
+    half_open: up to `half_open_max_calls` trial calls; a success closes the
+    circuit, a failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._clock = clock
+
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+        # Counters exposed through stats()
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit lets a trial call through"""
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (self._clock() - self._opened_at))
+
+    def _open(self):
+        if self._state != OPEN:
+            self.opened += 1
+            logger.warning("Circuit %s opened after %d consecutive failure(s)",
+                           self.name, self._consecutive_failures)
+        self._state = OPEN
+        self._opened_at = self._clock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now"""
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._half_open_calls >= self.half_open_max_calls):
+            self.rejected += 1
+            raise CircuitOpenError(
+                self.name, "circuit_open", f"{self.name} circuit is open",
+                retry_after=self.retry_after() or self.recovery_timeout
+            )
+        if state == HALF_OPEN:
+            self._half_open_calls += 1
+
+    def record_success(self):
+        self.successes += 1
+        self._consecutive_failures = 0
+        if self._state != CLOSED:
+            logger.info("Circuit %s closed", self.name)
+        self._state = CLOSED
+        self._half_open_calls = 0
+
+    def record_failure(self):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def _release(self):
+        # A call that neither succeeded nor failed upstream frees its trial slot
+        if self._state == HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    async def call(self, func: Callable[[], Awaitable[Any]],
+                   is_failure: Callable[[BaseException], bool] = lambda e: True) -> Any:
+        """Run func() through the breaker; errors for which is_failure() is False
+        (e.g. bad requests) propagate without counting against the upstream"""
+        self.before_call()
+        try:
+            result = await func()
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self._release()
+            raise
+        except BaseException:
+            # Cancelled calls say nothing about the upstream's health
+            self._release()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        state = self.state
+        return {
+            "state": state,
+            "is_open": state == OPEN,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout_seconds": self.recovery_timeout,
+            "retry_after_seconds": round(self.retry_after(), 2),
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
@@ -0,0 +1,89 @@
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar, Union
+
+from services.errors import DeadlineExceededError
+
+T = TypeVar("T")
+
+
+class SharedDeadline:
+    """Deadline of work shared by several requests: the latest of theirs (None = no deadline)"""
+
+    __slots__ = ("at",)
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def extend(self, at: Optional[float]):
+        if self.at is not None:
+            self.at = None if at is None else max(self.at, at)
+
+
+# Absolute time.monotonic() deadline of the request being served, if any
+_deadline_var: ContextVar[Union[float, SharedDeadline, None]] = ContextVar("deadline", default=None)
+
+
+def parse_timeout_ms(value: Optional[str]) -> Optional[float]:
+    """Parse a client-supplied timeout header given in milliseconds, in seconds"""
+    if not value:
+        return None
+    try:
+        milliseconds = float(value)
+    except ValueError:
+        return None
+    return milliseconds / 1000 if milliseconds > 0 else None
+
+
+def set_deadline(seconds: Optional[float]):
+    """Give the current request `seconds` to finish; returns a token for reset_deadline()"""
+    return _deadline_var.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def reset_deadline(token):
+    _deadline_var.reset(token)
+
+
+def current() -> Optional[float]:
+    """The absolute time.monotonic() deadline in effect, or None"""
+    deadline = _deadline_var.get()
+    return deadline.at if isinstance(deadline, SharedDeadline) else deadline
+
+
+def use_shared(shared: SharedDeadline):
+    """Budget the rest of the current task against `shared`, which other waiters may extend"""
+    return _deadline_var.set(shared)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline (may be negative), or None without a deadline"""
+    deadline = current()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def timeout(cap: Optional[float], upstream: str) -> Optional[float]:
+    """The tighter of `cap` and the remaining budget; raises once the budget is spent"""
+    budget = remaining()
+    if budget is None:
+        return cap
+    if budget <= 0:
+        raise DeadlineExceededError(upstream, "deadline_exceeded", f"Deadline exceeded before calling {upstream}")
+    return budget if cap is None else min(cap, budget)
+
+
+def allows(delay: float) -> bool:
+    """Whether sleeping `delay` seconds (e.g. before a retry) still leaves some budget"""
+    budget = remaining()
+    return budget is None or delay < budget
+
+
+async def wait_for(awaitable: Awaitable[T], upstream: str) -> T:
+    """Await within the remaining budget, raising DeadlineExceededError when it runs out"""
+    budget = timeout(None, upstream)
+    if budget is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError as e:
+        raise DeadlineExceededError(upstream, "deadline_exceeded", f"Deadline exceeded waiting for {upstream}") from e
@@ -0,0 +1,299 @@
+import re
+import codecs
+import logging
+import math
+import time
+import asyncio
+import socket
+import hashlib
+import zipfile
+import ipaddress
+import tempfile
+import xml.etree.ElementTree as ElementTree
+from collections import Counter, OrderedDict
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+import httpx
+import numpy as np
+from services import deadline
+from services.semantic_cache import HashingVectorizer, tokenize
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+_WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Keep small downloads in memory and spill larger ones to disk
+_SPOOL_MAX_BYTES = 2 * 1024 * 1024
+_MAX_REDIRECTS = 5
+
+
+def is_document_url(value: Optional[str]) -> bool:
+    return bool(value) and re.match(r"^https?://", value.strip(), re.IGNORECASE) is not None
+
+
+async def check_public_url(url: httpx.URL):
+    """Raise ValueError unless url is http(s) and its host resolves only to public addresses
+
+    Keeps user-supplied document URLs (and their redirects) away from loopback,
+    private and link-local hosts such as cloud metadata at 169.254.169.254.
+    """
+    if url.scheme not in ("http", "https") or not url.host:
+        raise ValueError(f"Unsupported document URL: {url}")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            url.host, url.port or (443 if url.scheme == "https" else 80), type=socket.SOCK_STREAM
+        )
+    except socket.gaierror as e:
+        raise ValueError(f"Could not resolve document host {url.host}: {e}") from e
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"Document host {url.host} resolves to a non-public address")
+
+
+def _detect_format(url: str, content_type: str, head: bytes) -> str:
+    content_type = (content_type or "").lower()
+    path = url.lower().split("?", 1)[0]
+    if head.startswith(b"%PDF") or "pdf" in content_type or path.endswith(".pdf"):
+        return "pdf"
+    if "wordprocessingml" in content_type or path.endswith(".docx"):
+        return "docx"
+    return "text"
+
+
+def _iter_pdf_text(file: IO[bytes]) -> Iterator[str]:
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError("PDF documents require the 'pypdf' package")
+    for page in PdfReader(file).pages:
+        text = page.extract_text() or ""
+        if text.strip():
+            yield text
+
+
+def _iter_docx_text(file: IO[bytes]) -> Iterator[str]:
+    """Read paragraphs straight from word/document.xml, no python-docx needed"""
+    with zipfile.ZipFile(file) as archive:
+        with archive.open("word/document.xml") as document:
+            for _, element in ElementTree.iterparse(document):
+                if element.tag == f"{_WORD_NAMESPACE}p":
+                    text = "".join(node.text or "" for node in element.iter(f"{_WORD_NAMESPACE}t"))
+                    if text.strip():
+                        yield text
+                    element.clear()
+
+
+def _iter_plain_text(file: IO[bytes]) -> Iterator[str]:
+    # Incremental decoding keeps multi-byte characters intact across block boundaries
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        block = file.read(64 * 1024)
+        text = decoder.decode(block, final=not block)
+        if text.strip():
+            yield text
+        if not block:
+            break
+
+
+def iter_document_text(file: IO[bytes], doc_format: str) -> Iterator[str]:
+    """Yield a document's text piece by piece (pages, paragraphs or lines)"""
+    if doc_format == "pdf":
+        return _iter_pdf_text(file)
+    if doc_format == "docx":
+        return _iter_docx_text(file)
+    return _iter_plain_text(file)
+
+
+def chunk_words(pieces: Iterable[str], chunk_words: int, overlap_words: int) -> Iterator[str]:
+    """Split streamed text into overlapping windows of roughly chunk_words words"""
+    step = max(1, chunk_words - overlap_words)
+    window: List[str] = []
+    emitted = False
+    for piece in pieces:
+        window.extend(piece.split())
+        while len(window) >= chunk_words:
+            yield " ".join(window[:chunk_words])
+            window = window[step:]
+            emitted = True
+    # Emit the tail unless it is entirely covered by the previous chunk's overlap
+    if window and (not emitted or len(window) > overlap_words):
+        yield " ".join(window)
+
+
+class DocumentIndex:
+    """In-memory hybrid index (BM25 + hashed vectors) over a document's chunks"""
+
+    def __init__(self, chunks: List[str], content_hash: str, vectorizer: HashingVectorizer,
+                 k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.content_hash = content_hash
+        self.vectorizer = vectorizer
+        self.k1 = k1
+        self.b = b
+
+        self._term_counts = [Counter(tokenize(chunk)) for chunk in chunks]
+        self._lengths = np.array([sum(counts.values()) for counts in self._term_counts], dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if chunks else 0.0
+        document_frequency = Counter()
+        for counts in self._term_counts:
+            document_frequency.update(counts.keys())
+        total = len(chunks)
+        self._idf = {
+            term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+        self._vectors = np.vstack([vectorizer.embed(chunk) for chunk in chunks]) if chunks else \
+            np.zeros((0, vectorizer.dim), dtype=np.float32)
+
+    def _bm25_scores(self, query_terms: List[str]) -> np.ndarray:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        norms = self.k1 * (1 - self.b + self.b * self._lengths / max(self._avg_length, 1e-9))
+        for term in set(query_terms):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            tf = np.array([counts.get(term, 0) for counts in self._term_counts], dtype=np.float32)
+            scores += idf * tf * (self.k1 + 1) / (tf + norms)
+        return scores
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Fuse BM25 and vector rankings with reciprocal rank fusion"""
+        if not self.chunks:
+            return []
+        bm25 = self._bm25_scores(tokenize(query))
+        cosine = self._vectors @ self.vectorizer.embed(query)
+
+        fused = np.zeros(len(self.chunks), dtype=np.float64)
+        for scores in (bm25, cosine):
+            ranks = np.empty(len(scores), dtype=np.int64)
+            ranks[np.argsort(-scores, kind="stable")] = np.arange(len(scores))
+            fused += 1.0 / (60 + ranks)
+
+        best = np.argsort(-fused, kind="stable")[:top_k]
+        return [(self.chunks[i], float(fused[i])) for i in best]
+
+
+class DocumentIndexCache:
+    """Fetches, parses and indexes documents, caching indexes by URL and content hash"""
+
+    def __init__(self, max_documents: int, ttl_seconds: float, max_bytes: int,
+                 chunk_words: int, overlap_words: int, dim: int = 1024,
+                 allow_private_hosts: bool = False, download_timeout: float = 30.0):
+        self.max_documents = max(1, max_documents)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # Cap on the whole download (slow-drip servers pass httpx's per-read timeout)
+        self.download_timeout = download_timeout
+        # Only for local testing: skip the public-address check on document URLs
+        self.allow_private_hosts = allow_private_hosts
+        self.chunk_words = chunk_words
+        self.overlap_words = overlap_words
+        self.vectorizer = HashingVectorizer(dim)
+
+        self._by_url: "OrderedDict[str, Tuple[DocumentIndex, float]]" = OrderedDict()
+        self._by_hash: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self._flight = SingleFlight()
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.hash_hits = 0
+        self.builds = 0
+        self.total_build_ms = 0.0
+
+    async def _open(self, client: httpx.AsyncClient, url: str) -> httpx.Response:
+        """Send the GET, following redirects by hand so every hop's host is checked"""
+        target = httpx.URL(url)
+        for _ in range(_MAX_REDIRECTS + 1):
+            if not self.allow_private_hosts:
+                await check_public_url(target)
+            response = await client.send(client.build_request("GET", target), stream=True)
+            if not response.is_redirect:
+                return response
+            await response.aclose()
+            target = response.url.join(response.headers["Location"])
+        raise ValueError(f"Document URL redirected more than {_MAX_REDIRECTS} times")
+
+    async def _download(self, client: httpx.AsyncClient, url: str) -> Tuple[IO[bytes], str, str]:
+        """Stream the document into a spooled temp file, hashing it on the way"""
+        file = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            response = await self._open(client, url)
+            try:
+                response.raise_for_status()
+                content_type = response.headers.get("Content-Type", "")
+                async for block in response.aiter_bytes():
+                    size += len(block)
+                    if size > self.max_bytes:
+                        raise ValueError(f"Document is larger than {self.max_bytes} bytes")
+                    digest.update(block)
+                    file.write(block)
+            finally:
+                await response.aclose()
+            file.seek(0)
+        except BaseException:
+            # HTTP errors, oversized documents, timeouts and cancellation all drop the partial file
+            file.close()
+            raise
+        return file, content_type, digest.hexdigest()
+
+    def _build(self, url: str, file: IO[bytes], content_type: str, content_hash: str) -> DocumentIndex:
+        with file:
+            doc_format = _detect_format(url, content_type, file.read(8))
+            file.seek(0)
+            chunks = list(chunk_words(
+                iter_document_text(file, doc_format), self.chunk_words, self.overlap_words
+            ))
+        return DocumentIndex(chunks, content_hash, self.vectorizer)
+
+    def _remember(self, url: str, index: DocumentIndex):
+        self._by_url[url] = (index, time.time() + self.ttl_seconds)
+        self._by_url.move_to_end(url)
+        while len(self._by_url) > self.max_documents:
+            self._by_url.popitem(last=False)
+        self._by_hash[index.content_hash] = index
+        self._by_hash.move_to_end(index.content_hash)
+        while len(self._by_hash) > self.max_documents:
+            self._by_hash.popitem(last=False)
+
+    async def _load(self, client: httpx.AsyncClient, url: str) -> DocumentIndex:
+        limit = deadline.timeout(self.download_timeout, "document")
+        try:
+            file, content_type, content_hash = await asyncio.wait_for(self._download(client, url), limit)
+        except asyncio.TimeoutError as e:
+            raise ValueError(f"Document download took longer than {limit:.1f}s") from e
+
+        # The same policy PDF served from a different URL reuses the existing index
+        index = self._by_hash.get(content_hash)
+        if index is not None:
+            file.close()
+            self.hash_hits += 1
+        else:
+            started = time.perf_counter()
+            index = await asyncio.to_thread(self._build, url, file, content_type, content_hash)
+            self.builds += 1
+            self.total_build_ms += (time.perf_counter() - started) * 1000
+            logger.info("Indexed document", extra={"url": url, "chunks": len(index.chunks)})
+
+        self._remember(url, index)
+        return index
+
+    async def get(self, client: httpx.AsyncClient, url: str) -> DocumentIndex:
+        """Return the index for url, ingesting the document at most once at a time"""
+        entry = self._by_url.get(url)
+        if entry is not None and entry[1] > time.time():
+            self._by_url.move_to_end(url)
+            self.hits += 1
+            return entry[0]
+        return await self._flight.do(url, lambda: self._load(client, url))
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self._by_url),
+            "max_documents": self.max_documents,
+            "hits": self.hits,
+            "hash_hits": self.hash_hits,
+            "builds": self.builds,
+            "avg_build_ms": round(self.total_build_ms / self.builds, 2) if self.builds else 0.0,
+        }
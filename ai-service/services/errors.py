@@ -0,0 +1,45 @@
+from typing import Optional
+
+
+class UpstreamError(Exception):
+    """An upstream dependency failed; `reason` is a stable, machine-readable code"""
+
+    def __init__(self, upstream: str, reason: str, message: str = None,
+                 status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message or f"{upstream} error: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class UpstreamAuthError(UpstreamError):
+    """No usable credentials for the upstream"""
+
+
+class UpstreamTimeoutError(UpstreamError):
+    """The upstream did not answer within the request timeout"""
+
+
+class UpstreamUnavailableError(UpstreamError):
+    """The upstream is down, overloaded (5xx/429) or unreachable"""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """The upstream's circuit breaker is open, so the call was not attempted"""
+
+
+class DeadlineExceededError(UpstreamError):
+    """The request's deadline ran out; not counted as an upstream outage"""
+
+
+class AdmissionRejectedError(Exception):
+    """A request was shed before doing any work: its priority queue was full (429)
+    or it waited too long for capacity (503)"""
+
+    def __init__(self, priority_class: str, reason: str, status_code: int, retry_after: float):
+        super().__init__(f"Service is overloaded ({priority_class} {reason}), retry after {retry_after:.0f}s")
+        self.priority_class = priority_class
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
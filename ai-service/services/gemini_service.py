@@ -1,21 +1,59 @@
 import os
+import json
+import time
+import logging
 import google.generativeai as genai
-import requests
+import httpx
 import asyncio
-from typing import List
+from typing import AsyncIterator, List, Optional, Tuple
 from dotenv import load_dotenv
-import google.auth
-from google.auth.transport.requests import Request
+from services.token_manager import GoogleTokenManager
+from services.http_client import HttpClientConfig, create_http_client
+from services.generation import GenerationRunner, is_retryable_error, retry_after_from_error
+from services.rate_limiter import TokenBucket, BackoffPolicy, RETRYABLE_STATUS_CODES, parse_retry_after
+from services.answer_cache import AnswerCache, SQLiteCacheBackend, normalize_query, make_cache_key
+from services.semantic_cache import SemanticCache
+from services.single_flight import SingleFlight
+from services.document_index import DocumentIndex, DocumentIndexCache, is_document_url
+from services.search_result import SearchResult, parse_search_response
+from services.search_cache import SearchResultCache
+from services.prompt_builder import PromptBuilder, SUMMARY_TEMPLATE, estimate_tokens
+from services.chat_sessions import (
+    ChatSession, ChatSessionStore, SQLiteSessionStore, REUSE, SEARCH, format_turns, history_text, fold_turns
+)
+from services.answer_router import AnswerRouter, Route
+from services.batch_generation import build_batch_prompt, parse_batch_answers
+from services.circuit_breaker import CircuitBreaker, CLOSED
+from services.errors import (
+    UpstreamError, UpstreamAuthError, UpstreamTimeoutError, UpstreamUnavailableError, DeadlineExceededError
+)
+from services.hedging import HedgePolicy, hedged
+from services import deadline
+from services.metrics import PROMPT_TOKENS, STAGE_SECONDS, OPERATION_SECONDS, UPSTREAM_IN_FLIGHT, UPSTREAM_ERRORS, timed
 
 load_dotenv('.env.local')  # Load local secrets first
 load_dotenv()  # Load .env as fallback
 
+logger = logging.getLogger(__name__)
+
+NO_INFORMATION_ANSWER = "The knowledge base doesn't contain specific information to answer this question."
+CHAT_NO_MATCH_RESPONSE = "I can only provide information based on the specific knowledge base I have access to. Your question doesn't match any content in the knowledge base. Please ask questions related to the uploaded documents or try rephrasing your question."
+CHAT_ERROR_RESPONSE = "I'm sorry, I encountered an error while searching the knowledge base. Please try again."
+SEARCH_UNAVAILABLE_ANSWER = "The knowledge base is temporarily unavailable, so this question could not be answered. Please try again shortly."
+NO_MATCH_CONTEXT = "I couldn't find specific information about this in the knowledge base. Please ensure your question relates to the uploaded documents."
+CHAT_UNAVAILABLE_RESPONSE = "I'm sorry, the knowledge base is temporarily unavailable. Please try again in a moment."
+
+# Bump when prompt templates change so cached answers from old prompts are not reused
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "2")
+
+
+def _is_search_outage(error: BaseException) -> bool:
+    """Timeouts, 5xx/429 and connection errors count against the search circuit"""
+    return isinstance(error, (UpstreamTimeoutError, UpstreamUnavailableError))
+
+
 class GeminiService:
     def __init__(self):
-        # Reload environment variables
-        load_dotenv()
-        load_dotenv('.env.local')  # Load local secrets as override
-        
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
         if not self.gemini_api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
@@ -24,6 +62,128 @@ class GeminiService:
         genai.configure(api_key=self.gemini_api_key)
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
         
+        # Generation is blocking, so it runs on a bounded pool sized to our Gemini quota
+        self.generation = GenerationRunner(int(os.getenv("GEMINI_MAX_CONCURRENCY", 8)))
+        
+        # Upstream quotas (0 disables a limit) and retry policy for 429/503 responses
+        self.search_limiter = TokenBucket(float(os.getenv("DISCOVERY_QPS", 0)))
+        self.gemini_limiter = TokenBucket.per_minute(float(os.getenv("GEMINI_RPM", 0)))
+        self.gemini_token_limiter = TokenBucket.per_minute(float(os.getenv("GEMINI_TPM", 0)))
+        self.expected_output_tokens = int(os.getenv("GEMINI_EXPECTED_OUTPUT_TOKENS", 256))
+        backoff_base = float(os.getenv("RETRY_BACKOFF_BASE_SECONDS", 0.5))
+        backoff_max = float(os.getenv("RETRY_BACKOFF_MAX_SECONDS", 8))
+        self.search_breaker = CircuitBreaker(
+            "discovery_engine",
+            failure_threshold=int(os.getenv("DISCOVERY_CIRCUIT_FAILURE_THRESHOLD", 5)),
+            recovery_timeout=float(os.getenv("DISCOVERY_CIRCUIT_RECOVERY_SECONDS", 30)),
+            half_open_max_calls=int(os.getenv("DISCOVERY_CIRCUIT_HALF_OPEN_CALLS", 1))
+        )
+        # Optionally send a duplicate search when the first is slower than the hedge percentile
+        self.search_hedge = None
+        if os.getenv("DISCOVERY_HEDGE_ENABLED", "False").lower() == "true":
+            self.search_hedge = HedgePolicy(
+                percentile=float(os.getenv("DISCOVERY_HEDGE_PERCENTILE", 95)),
+                budget_ratio=float(os.getenv("DISCOVERY_HEDGE_BUDGET_RATIO", 0.05)),
+                default_delay=float(os.getenv("DISCOVERY_HEDGE_DEFAULT_DELAY_MS", 1000)) / 1000,
+                min_delay=float(os.getenv("DISCOVERY_HEDGE_MIN_DELAY_MS", 50)) / 1000
+            )
+        self.search_backoff = BackoffPolicy(int(os.getenv("DISCOVERY_MAX_RETRIES", 3)), backoff_base, backoff_max)
+        self.gemini_backoff = BackoffPolicy(int(os.getenv("GEMINI_MAX_RETRIES", 3)), backoff_base, backoff_max)
+        
+        # Answers are cached by normalized question, engine ID and prompt version
+        self.answer_cache = None
+        if os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true":
+            cache_path = os.getenv("ANSWER_CACHE_SQLITE_PATH")
+            self.answer_cache = AnswerCache(
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 1024)),
+                ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 3600)),
+                backend=SQLiteCacheBackend(cache_path) if cache_path else None,
+                purge_interval=float(os.getenv("ANSWER_CACHE_PURGE_INTERVAL_SECONDS", 300))
+            )
+        
+        # Reworded questions (same key terms, very close embeddings) reuse answers; opt-in
+        self.semantic_cache = None
+        if os.getenv("SEMANTIC_CACHE_ENABLED", "False").lower() == "true":
+            self.semantic_cache = SemanticCache(
+                threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.97)),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2048)),
+                ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 3600)),
+                dim=int(os.getenv("SEMANTIC_CACHE_DIM", 1024))
+            )
+        
+        # Parsed search results are reused (and refreshed in the background once stale)
+        self.search_cache = None
+        if os.getenv("SEARCH_CACHE_ENABLED", "True").lower() == "true":
+            self.search_cache = SearchResultCache(
+                max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 2048)),
+                ttl_seconds=float(os.getenv("SEARCH_CACHE_TTL_SECONDS", 600)),
+                stale_seconds=float(os.getenv("SEARCH_CACHE_STALE_SECONDS", 3600)),
+                invalidation_path=os.getenv("SEARCH_CACHE_INVALIDATION_FILE") or None
+            )
+        
+        # Identical searches/generations in flight at the same moment are coalesced
+        self.search_flight = SingleFlight()
+        self.generation_flight = SingleFlight()
+        
+        # How many top Discovery Engine passages (besides the summary) go into a prompt
+        self.search_context_passages = int(os.getenv("DISCOVERY_CONTEXT_PASSAGES", 3))
+        
+        # Retrieved context is deduplicated and trimmed to a token budget before prompting
+        self.prompt_builder = PromptBuilder(
+            context_token_budget=int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", 1500)),
+            duplicate_threshold=float(os.getenv("PROMPT_DUPLICATE_THRESHOLD", 0.9))
+        )
+        self.gemini_usage = {"responses": 0, "prompt_tokens": 0, "output_tokens": 0}
+        
+        # Questions a search result already answers (scored extractive segment, top
+        # extractive answer or cited summary) are answered without calling Gemini
+        self.answer_router = None
+        if os.getenv("ANSWER_ROUTER_ENABLED", "True").lower() == "true":
+            self.answer_router = AnswerRouter(
+                segment_min_score=float(os.getenv("ANSWER_ROUTER_SEGMENT_MIN_SCORE", 0.9)),
+                min_term_coverage=float(os.getenv("ANSWER_ROUTER_MIN_TERM_COVERAGE", 0.6)),
+                max_chars=int(os.getenv("ANSWER_ROUTER_MAX_CHARS", 1200)),
+                use_summary=os.getenv("ANSWER_ROUTER_USE_SUMMARY", "True").lower() == "true"
+            )
+        
+        # Chat sessions: recent turns verbatim, older ones folded into a running summary
+        # (by Gemini, in the background) so prompts stay about the same size every turn
+        self.chat_sessions = None
+        if os.getenv("CHAT_SESSIONS_ENABLED", "True").lower() == "true":
+            session_path = os.getenv("CHAT_SESSION_STORE_PATH")
+            self.chat_sessions = ChatSessionStore(
+                max_sessions=int(os.getenv("CHAT_SESSION_MAX_SESSIONS", 1000)),
+                ttl_seconds=float(os.getenv("CHAT_SESSION_TTL_SECONDS", 3600)),
+                topic_threshold=float(os.getenv("CHAT_SESSION_TOPIC_THRESHOLD", 0.75)),
+                backend=SQLiteSessionStore(session_path) if session_path else None
+            )
+        self.session_recent_turns = max(1, int(os.getenv("CHAT_SESSION_RECENT_TURNS", 4)))
+        self.session_history_token_budget = int(os.getenv("CHAT_SESSION_HISTORY_TOKEN_BUDGET", 500))
+        self.session_summary_token_budget = int(os.getenv("CHAT_SESSION_SUMMARY_TOKEN_BUDGET", 200))
+        self._background_tasks = set()
+        
+        # Local retrieval over QuestionRequest.documents, cached per document URL/hash
+        self.document_indexes = None
+        self.document_top_k = int(os.getenv("DOCUMENT_TOP_K", 4))
+        if os.getenv("DOCUMENT_RETRIEVAL_ENABLED", "True").lower() == "true":
+            self.document_indexes = DocumentIndexCache(
+                max_documents=int(os.getenv("DOCUMENT_INDEX_CACHE_SIZE", 16)),
+                ttl_seconds=float(os.getenv("DOCUMENT_INDEX_TTL_SECONDS", 3600)),
+                max_bytes=int(os.getenv("DOCUMENT_MAX_BYTES", 25 * 1024 * 1024)),
+                chunk_words=int(os.getenv("DOCUMENT_CHUNK_WORDS", 200)),
+                overlap_words=int(os.getenv("DOCUMENT_CHUNK_OVERLAP_WORDS", 40)),
+                allow_private_hosts=os.getenv("DOCUMENT_ALLOW_PRIVATE_HOSTS", "False").lower() == "true",
+                download_timeout=float(os.getenv("DOCUMENT_DOWNLOAD_TIMEOUT_SECONDS", 30))
+            )
+        
+        # How many /hackrx/run questions are worked on at once (1 = one after another)
+        self.question_concurrency = max(1, int(os.getenv("HACKRX_QUESTION_CONCURRENCY", 5)))
+        
+        # Optionally answer all questions of a request with a few JSON-mode prompts
+        self.batch_generation = os.getenv("HACKRX_BATCH_GENERATION", "False").lower() == "true"
+        self.batch_size = max(1, int(os.getenv("HACKRX_BATCH_SIZE", 20)))
+        self.batch_stats = {"batches": 0, "batched_answers": 0, "fallbacks": 0}
+        
         # Google Discovery Engine configuration - MUST match your actual setup
         self.project_id = os.getenv("GOOGLE_PROJECT_ID")
         self.engine_id = os.getenv("DISCOVERY_ENGINE_ID")
@@ -36,296 +196,856 @@ class GeminiService:
         if not self.engine_id:
             raise ValueError("DISCOVERY_ENGINE_ID environment variable is required")
         
-        print(f"🔧 Initialized with Project ID: {self.project_id}")
-        print(f"🔧 Engine ID: {self.engine_id}")
-        print(f"🔧 Location: {self.location}")
-        print(f"🔧 Collection: {self.collection}")
+        logger.info("Initialized Discovery Engine configuration", extra={
+            "project_id": self.project_id,
+            "engine_id": self.engine_id,
+            "location": self.location,
+            "collection": self.collection
+        })
         
         # Discovery Engine endpoint
-        self.discovery_endpoint = f"https://discoveryengine.googleapis.com/v1alpha/projects/{self.project_id}/locations/{self.location}/collections/{self.collection}/engines/{self.engine_id}/servingConfigs/default_search:search"
-        print(f"🔗 Discovery Endpoint: {self.discovery_endpoint}")
+        self.discovery_endpoint = self._build_discovery_endpoint()
+        logger.info("Discovery endpoint: %s", self.discovery_endpoint)
+        
+        # Everything in a search request except the query; cached results are keyed on it too
+        self.search_spec = {
+            "pageSize": 5,  # Reduced to get more focused results
+            "queryExpansionSpec": {"condition": "AUTO"},
+            "spellCorrectionSpec": {"mode": "AUTO"},
+            "languageCode": "en-US",
+            "contentSearchSpec": {
+                "extractiveContentSpec": {
+                    "maxExtractiveAnswerCount": 3,
+                    "maxExtractiveSegmentCount": 1,
+                    "returnExtractiveSegmentScore": True
+                },
+                "summarySpec": {
+                    "summaryResultCount": 3,
+                    "includeCitations": True
+                }
+            },
+            "userInfo": {"timeZone": "Asia/Calcutta"}
+        }
+        self.search_spec_key = make_cache_key(self.discovery_endpoint, json.dumps(self.search_spec, sort_keys=True))
+        
+        # Credentials are built once and the token is cached until close to expiry
+        self.token_manager = GoogleTokenManager(self.project_id)
+        
+        # Pooled async HTTP client, created at app startup (or lazily on first use)
+        self.http_config = HttpClientConfig()
+        self.http_client: Optional[httpx.AsyncClient] = None
+    
+    async def start(self):
+        """Open pooled upstream connections"""
+        if self.http_client is None:
+            self.http_client = create_http_client(self.http_config)
+    
+    async def warmup(self):
+        """Pay cold-start costs before serving: open the pool, fetch a token, optionally search"""
+        started = time.perf_counter()
+        await self.start()
+        if not await self.get_google_access_token():
+            logger.warning("Warmup could not fetch a Google access token")
+        
+        # A real search also opens (and TLS-handshakes) the pooled Discovery Engine connection
+        query = os.getenv("WARMUP_SEARCH_QUERY")
+        if query:
+            try:
+                await self.search_discovery_engine(query)
+            except UpstreamError as e:
+                logger.warning("Warmup search failed (%s)", e.reason)
+        logger.info("Warmup finished", extra={"warmup_ms": round((time.perf_counter() - started) * 1000, 1)})
+    
+    async def close(self):
+        """Stop background tasks and close connections owned by the service"""
+        await self.token_manager.stop()
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        if self.chat_sessions is not None:
+            self.chat_sessions.close()
+        if self.search_cache is not None:
+            await self.search_cache.close()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+        self.generation.shutdown()
+        if self.answer_cache is not None:
+            self.answer_cache.close()
+    
+    def health_status(self) -> str:
+        """'degraded' while Discovery Engine searches are failing fast"""
+        return "healthy" if self.search_breaker.state == CLOSED else "degraded"
+    
+    def component_stats(self) -> dict:
+        """Stats of every component, keyed by component name"""
+        return {
+            "auth": self.token_manager.stats(),
+            "generation": self.generation.stats(),
+            "rate_limit_discovery_search": self.search_limiter.stats(),
+            "rate_limit_gemini_requests": self.gemini_limiter.stats(),
+            "rate_limit_gemini_tokens": self.gemini_token_limiter.stats(),
+            "circuit_discovery_engine": self.search_breaker.stats(),
+            "hedging_discovery_search": self.search_hedge.stats() if self.search_hedge else None,
+            "retries": {
+                "discovery_engine": self.search_backoff.retries,
+                "gemini": self.gemini_backoff.retries
+            },
+            "answer_cache": self.answer_cache.stats() if self.answer_cache else None,
+            "semantic_cache": self.semantic_cache.stats() if self.semantic_cache else None,
+            "document_indexes": self.document_indexes.stats() if self.document_indexes else None,
+            "prompts": self.prompt_builder.stats(),
+            "answer_router": self.answer_router.stats() if self.answer_router else None,
+            "chat_sessions": self.chat_sessions.stats() if self.chat_sessions else None,
+            "gemini_usage": self.gemini_usage,
+            "batch_generation": {"enabled": self.batch_generation, **self.batch_stats},
+            "search_cache": self.search_cache.stats() if self.search_cache else None,
+            "coalescing_search": self.search_flight.stats(),
+            "coalescing_generation": self.generation_flight.stats()
+        }
+    
+    def _answer_cache_key(self, kind: str, text: str) -> str:
+        return make_cache_key(kind, PROMPT_VERSION, self.engine_id, normalize_query(text))
+    
+    def _semantic_namespace(self, kind: str) -> str:
+        return f"{kind}|{PROMPT_VERSION}|{self.engine_id}"
+    
+    async def _cached_answer(self, kind: str, text: str) -> Optional[str]:
+        """Look up an exact (normalized) match first, then a paraphrase match"""
+        if self.answer_cache is not None:
+            try:
+                cached = await self.answer_cache.get(self._answer_cache_key(kind, text))
+            except Exception as e:
+                # A failing cache backend (e.g. a locked SQLite file) is just a miss
+                logger.warning("Answer cache lookup failed: %s", e)
+                cached = None
+            if cached is not None:
+                return cached
+        
+        if self.semantic_cache is not None:
+            match = self.semantic_cache.lookup(self._semantic_namespace(kind), text)
+            if match is not None:
+                answer, similarity = match
+                logger.debug("Semantic cache hit", extra={"kind": kind, "similarity": round(similarity, 3)})
+                await self._store_answer(kind, text, answer)
+                return answer
+        return None
+    
+    async def _store_answer(self, kind: str, text: str, answer: str):
+        if self.answer_cache is None:
+            return
+        try:
+            await self.answer_cache.set(self._answer_cache_key(kind, text), answer)
+        except Exception as e:
+            # Never lose a good answer because the cache could not keep it
+            logger.warning("Answer cache write failed: %s", e)
+    
+    async def _cache_answer(self, kind: str, text: str, answer: str):
+        """Cache an answer; cache failures are logged, never raised"""
+        await self._store_answer(kind, text, answer)
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(self._semantic_namespace(kind), text, answer)
+    
+    def _answer_flight_key(self, kind: str, text: str, search_context: str) -> str:
+        """Coalescing key for answering `text` from `search_context`
+        
+        Matches the answer cache key (kind, normalized question), so questions the cache
+        treats as the same also share one generation while it is in flight.
+        """
+        return make_cache_key(self._answer_cache_key(kind, text), search_context)
+    
+    async def generate(self, prompt: str, flight_key: Optional[str] = None, **kwargs):
+        """Run Gemini generation without blocking the event loop
+        
+        Generations in flight at the same time with the same flight_key (by default:
+        identical prompts) share one call.
+        Extra keyword arguments (e.g. generation_config) go to generate_content.
+        Raises DeadlineExceededError when the request's deadline runs out first.
+        """
+        if flight_key is None:
+            flight_key = make_cache_key(prompt, repr(sorted(kwargs.items())))
+        return await deadline.wait_for(self.generation_flight.do(
+            flight_key, lambda: self._generate(prompt, **kwargs)
+        ), "gemini")
+    
+    async def _acquire_quota(self, prompt: str):
+        """Wait for Gemini request and token budget"""
+        # Rough prompt estimate plus room for the answer
+        estimated_tokens = estimate_tokens(prompt) + self.expected_output_tokens
+        await self.gemini_limiter.acquire()
+        await self.gemini_token_limiter.acquire(estimated_tokens)
+    
+    async def _generate(self, prompt: str, **kwargs):
+        """Generate under the RPM/TPM quota, retrying with backoff on 429/503"""
+        self._record_prompt(prompt)
+        attempt = 0
+        while True:
+            await deadline.wait_for(self._acquire_quota(prompt), "gemini")
+            call_kwargs = kwargs
+            request_timeout = deadline.timeout(None, "gemini")
+            if request_timeout is not None:
+                # Let the SDK give up too, so the worker thread is not held past the deadline
+                call_kwargs = {**kwargs, "request_options": {"timeout": request_timeout}}
+            try:
+                with STAGE_SECONDS.time(stage="generation"), \
+                     UPSTREAM_IN_FLIGHT.track_in_progress(upstream="gemini"):
+                    response = await deadline.wait_for(
+                        self.generation.run(self.model.generate_content, prompt, **call_kwargs), "gemini"
+                    )
+                self._record_usage(response)
+                return response
+            except DeadlineExceededError:
+                UPSTREAM_ERRORS.inc(upstream="gemini", reason="deadline_exceeded")
+                raise
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(upstream="gemini", reason=type(e).__name__)
+                if not is_retryable_error(e) or attempt >= self.gemini_backoff.max_retries:
+                    raise
+                delay = self.gemini_backoff.delay(attempt, retry_after_from_error(e))
+                if not deadline.allows(delay):
+                    raise
+                logger.warning("Gemini is throttling (%s), retrying in %.2fs", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    async def _stream_generate(self, prompt: str) -> AsyncIterator[str]:
+        """Stream generated text under the quota and deadline, like _generate
+        
+        A 429/503 before the first chunk is retried with backoff; once text has been
+        yielded an error is raised as is, since retrying would repeat the output.
+        """
+        self._record_prompt(prompt)
+        attempt = 0
+        while True:
+            await deadline.wait_for(self._acquire_quota(prompt), "gemini")
+            call_kwargs = {"stream": True}
+            request_timeout = deadline.timeout(None, "gemini")
+            if request_timeout is not None:
+                call_kwargs["request_options"] = {"timeout": request_timeout}
+            yielded = False
+            try:
+                with STAGE_SECONDS.time(stage="generation"), \
+                     UPSTREAM_IN_FLIGHT.track_in_progress(upstream="gemini"):
+                    chunks = self.generation.stream(self.model.generate_content, prompt, **call_kwargs)
+                    try:
+                        while True:
+                            try:
+                                chunk = await deadline.wait_for(chunks.__anext__(), "gemini")
+                            except StopAsyncIteration:
+                                return
+                            text = chunk.text
+                            if text:
+                                yielded = True
+                                yield text
+                    finally:
+                        await chunks.aclose()
+            except DeadlineExceededError:
+                UPSTREAM_ERRORS.inc(upstream="gemini", reason="deadline_exceeded")
+                raise
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(upstream="gemini", reason=type(e).__name__)
+                if yielded or not is_retryable_error(e) or attempt >= self.gemini_backoff.max_retries:
+                    raise
+                delay = self.gemini_backoff.delay(attempt, retry_after_from_error(e))
+                if not deadline.allows(delay):
+                    raise
+                logger.warning("Gemini is throttling (%s), retrying stream in %.2fs", type(e).__name__, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+    
+    def _record_prompt(self, prompt: str):
+        PROMPT_TOKENS.observe(self.prompt_builder.record(prompt))
+    
+    def _record_usage(self, response):
+        """Add Gemini's reported token counts, when the response carries them"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.gemini_usage["responses"] += 1
+        self.gemini_usage["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+        self.gemini_usage["output_tokens"] += getattr(usage, "candidates_token_count", 0) or 0
+    
+    def _build_discovery_endpoint(self) -> str:
+        # DISCOVERY_ENDPOINT_URL points the service at a local stand-in for load tests
+        override = os.getenv("DISCOVERY_ENDPOINT_URL")
+        if override:
+            return override
+        return f"https://discoveryengine.googleapis.com/v1alpha/projects/{self.project_id}/locations/{self.location}/collections/{self.collection}/engines/{self.engine_id}/servingConfigs/default_search:search"
     
     async def get_google_access_token(self):
-        """Get Google Cloud access token"""
+        """Get Google Cloud access token (cached and refreshed in the background)"""
         try:
-            credentials = None
+            token = await self.token_manager.get_token()
             
-            # Option 1: Try environment variables first (for Render deployment)
-            if os.getenv("GOOGLE_SERVICE_ACCOUNT_EMAIL") and os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY"):
-                from google.oauth2 import service_account
-                import json
-                
-                service_account_info = {
-                    "type": "service_account",
-                    "project_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_PROJECT_ID", self.project_id),
-                    "private_key_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY_ID", ""),
-                    "private_key": os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY").replace('\\n', '\n'),
-                    "client_email": os.getenv("GOOGLE_SERVICE_ACCOUNT_EMAIL"),
-                    "client_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_CLIENT_ID", ""),
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                    "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-                    "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{os.getenv('GOOGLE_SERVICE_ACCOUNT_EMAIL')}"
-                }
-                
-                credentials = service_account.Credentials.from_service_account_info(
-                    service_account_info,
-                    scopes=['https://www.googleapis.com/auth/cloud-platform']
-                )
-                print("✅ Using service account credentials from environment variables")
-                print(f"🔧 Service account project: {service_account_info['project_id']}")
-                
-                # Use the service account's project ID for Discovery Engine
-                self.project_id = service_account_info['project_id']
-                print(f"🔄 Updated project ID to: {self.project_id}")
-                
-                # Update the discovery endpoint with correct project ID
-                self.discovery_endpoint = f"https://discoveryengine.googleapis.com/v1alpha/projects/{self.project_id}/locations/{self.location}/collections/{self.collection}/engines/{self.engine_id}/servingConfigs/default_search:search"
+            # Service account credentials may carry their own project ID
+            if self.token_manager.project_id != self.project_id:
+                self.project_id = self.token_manager.project_id
+                logger.info("Updated project ID to %s", self.project_id)
+                self.discovery_endpoint = self._build_discovery_endpoint()
             
-            # Option 2: Try service account key file
-            elif os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
-                service_account_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-                if os.path.exists(service_account_path):
-                    from google.oauth2 import service_account
-                    credentials = service_account.Credentials.from_service_account_file(
-                        service_account_path,
-                        scopes=['https://www.googleapis.com/auth/cloud-platform']
-                    )
-                    print("✅ Using service account credentials from file")
+            return token
             
-            # Option 3: Try default credentials (ADC)
-            else:
-                credentials, project = google.auth.default(
-                    scopes=['https://www.googleapis.com/auth/cloud-platform']
-                )
-                print("✅ Using default application credentials")
-            
-            if credentials:
-                credentials.refresh(Request())
-                return credentials.token
-            else:
-                raise Exception("No valid credentials found")
+        except Exception as e:
+            logger.error(
+                "Error getting Google access token: %s. Set service account environment variables, "
+                "set GOOGLE_APPLICATION_CREDENTIALS to a key file path, "
+                "or run: gcloud auth application-default login", e
+            )
+            return None
+    
+    async def _send_search(self, headers: dict, payload: dict) -> httpx.Response:
+        """One search POST, hedged with a duplicate when hedging is enabled"""
+        def send():
+            return self.http_client.post(self.discovery_endpoint, headers=headers, json=payload)
+        
+        if self.search_hedge is None:
+            return await send()
+        # The duplicate only goes out if the QPS limit has a token to spare right now
+        return await hedged(send, self.search_hedge, can_hedge=self.search_limiter.try_acquire)
+    
+    async def _post_search(self, headers: dict, payload: dict) -> httpx.Response:
+        """POST a search under the QPS limit and deadline, retrying 429/503 with backoff"""
+        if self.http_client is None:
+            await self.start()
+        
+        attempt = 0
+        while True:
+            await deadline.wait_for(self.search_limiter.acquire(), "discovery_engine")
+            # Bounded by whichever is tighter: the request's remaining budget or the total timeout
+            request_timeout = deadline.timeout(self.http_config.total_timeout, "discovery_engine")
+            try:
+                response = await asyncio.wait_for(self._send_search(headers, payload), timeout=request_timeout)
+            except asyncio.TimeoutError as e:
+                if request_timeout < self.http_config.total_timeout:
+                    raise DeadlineExceededError(
+                        "discovery_engine", "deadline_exceeded", "Deadline exceeded waiting for search"
+                    ) from e
+                raise
+            if response.status_code != 200:
+                UPSTREAM_ERRORS.inc(upstream="discovery_engine", reason=str(response.status_code))
+            if response.status_code not in RETRYABLE_STATUS_CODES or \
+               attempt >= self.search_backoff.max_retries:
+                return response
             
+            delay = self.search_backoff.delay(
+                attempt, parse_retry_after(response.headers.get("Retry-After"))
+            )
+            if not deadline.allows(delay):
+                return response
+            logger.warning("Discovery Engine returned %s, retrying in %.2fs", response.status_code, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+    
+    @timed(OPERATION_SECONDS, operation="search")
+    async def search_discovery_engine(self, query: str) -> SearchResult:
+        """Search your trained Discovery Engine
+        
+        Results are served from the search cache when present (stale ones are refreshed
+        in the background); concurrent searches for the same normalized query share one
+        request. Raises an UpstreamError when the search fails, CircuitOpenError without
+        calling Discovery Engine while its circuit is open, and DeadlineExceededError
+        once the request's deadline has passed.
+        """
+        normalized = normalize_query(query)
+        
+        def fetch():
+            return self.search_flight.do(
+                normalized,
+                lambda: self.search_breaker.call(lambda: self._search_discovery_engine(query), _is_search_outage)
+            )
+        
+        if self.search_cache is None:
+            return await deadline.wait_for(fetch(), "discovery_engine")
+        return await deadline.wait_for(
+            self.search_cache.get_or_fetch(make_cache_key(self.search_spec_key, normalized), fetch),
+            "discovery_engine"
+        )
+    
+    async def _search_discovery_engine(self, query: str) -> SearchResult:
+        with STAGE_SECONDS.time(stage="token_fetch"):
+            access_token = await self.get_google_access_token()
+        if not access_token:
+            UPSTREAM_ERRORS.inc(upstream="google_auth", reason="no_token")
+            raise UpstreamAuthError("google_auth", "no_token", "Unable to authenticate with Google Cloud")
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        payload = {"query": query, **self.search_spec}
+        
+        logger.debug("Searching Discovery Engine", extra={"query": query, "payload": payload})
+        
+        try:
+            with STAGE_SECONDS.time(stage="http_search"), \
+                 UPSTREAM_IN_FLIGHT.track_in_progress(upstream="discovery_engine"):
+                response = await self._post_search(headers, payload)
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            UPSTREAM_ERRORS.inc(upstream="discovery_engine", reason="timeout")
+            logger.error("Discovery Engine search timed out after %ss", self.http_config.total_timeout)
+            raise UpstreamTimeoutError(
+                "discovery_engine", "timeout", f"Search timed out after {self.http_config.total_timeout}s"
+            ) from e
+        except httpx.HTTPError as e:
+            UPSTREAM_ERRORS.inc(upstream="discovery_engine", reason=type(e).__name__)
+            logger.error("Error searching Discovery Engine: %s", e)
+            raise UpstreamUnavailableError("discovery_engine", type(e).__name__, str(e)) from e
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Discovery Engine response", extra={
+                "status": response.status_code, "body_preview": response.text[:500]
+            })
+        
+        if response.status_code != 200:
+            logger.error("Discovery Engine API error", extra={
+                "status": response.status_code, "body_preview": response.text[:500]
+            })
+            # Overload/outage statuses trip the circuit; other 4xx are our own bad requests
+            outage = response.status_code >= 500 or response.status_code in RETRYABLE_STATUS_CODES
+            raise (UpstreamUnavailableError if outage else UpstreamError)(
+                "discovery_engine", f"http_{response.status_code}",
+                f"Search service error: {response.status_code}",
+                status_code=response.status_code,
+                retry_after=parse_retry_after(response.headers.get("Retry-After"))
+            )
+        
+        with STAGE_SECONDS.time(stage="result_extraction"):
+            try:
+                result = parse_search_response(response.content)
+            except ValueError as e:
+                UPSTREAM_ERRORS.inc(upstream="discovery_engine", reason="invalid_response")
+                raise UpstreamUnavailableError("discovery_engine", "invalid_response", str(e)) from e
+            logger.debug("Parsed search response", extra={
+                "passages": len(result.passages), "citations": len(result.citations), "has_summary": bool(result.summary)
+            })
+            return result
+    
+    def _search_context(self, result: SearchResult) -> str:
+        """The summary plus the top passages of a search, or a no-match notice"""
+        if not result:
+            logger.info("No relevant information found in the knowledge base")
+            return NO_MATCH_CONTEXT
+        return result.context(self.search_context_passages)
+    
+    async def load_document_index(self, document_url: str) -> Optional[DocumentIndex]:
+        """Ingest and index the request's document, or None to use Discovery Engine"""
+        if self.document_indexes is None or not is_document_url(document_url):
+            return None
+        if self.http_client is None:
+            await self.start()
+        try:
+            return await deadline.wait_for(
+                self.document_indexes.get(self.http_client, document_url.strip()), "document"
+            )
         except Exception as e:
-            print(f"❌ Error getting Google access token: {str(e)}")
-            print("Please set up Google Cloud authentication:")
-            print("1. Set environment variables for service account")
-            print("2. Or set GOOGLE_APPLICATION_CREDENTIALS to key file path")
-            print("3. Or run: gcloud auth application-default login")
+            logger.warning("Could not index document, falling back to Discovery Engine: %s", e,
+                           extra={"url": document_url})
             return None
     
-    async def search_discovery_engine(self, query: str) -> str:
-        """Search your trained Discovery Engine"""
+    def _document_context(self, document_index: DocumentIndex, question: str) -> str:
+        """Join the top-k chunks for the question into a context block"""
+        passages = document_index.search(question, self.document_top_k)
+        return "\n\n".join(chunk for chunk, _ in passages)
+    
+    def _question_cache_kind(self, document_index: Optional[DocumentIndex]) -> str:
+        # Answers from a specific document are cached separately per document content
+        return f"document:{document_index.content_hash}" if document_index else "question"
+    
+    def _route(self, question: str, result: SearchResult, started: float) -> Optional[Route]:
+        return self.answer_router.route(question, result, started) if self.answer_router else None
+    
+    def _finish_route(self, route: Optional[Route]):
+        if route is not None:
+            self.answer_router.finish(route)
+    
+    async def _question_context(self, question: str, document_index: Optional[DocumentIndex],
+                                started: float) -> Tuple[str, Optional[Route]]:
+        """The question's context, and its answer route when it came from Discovery Engine"""
+        if document_index is not None:
+            # Retrieve from the locally indexed document
+            return self._document_context(document_index, question), None
+        # Search your Discovery Engine for relevant context
+        result = await self.search_discovery_engine(question)
+        return self._search_context(result), self._route(question, result, started)
+    
+    @staticmethod
+    def _clean_answer(answer: str) -> str:
+        """Validate that the answer seems to be based on the context"""
+        if "knowledge base doesn't contain" in answer.lower() or \
+           "don't have information" in answer.lower():
+            return NO_INFORMATION_ANSWER
+        return answer
+    
+    def _question_prompt(self, question: str, search_context: str) -> str:
+        """Use Gemini to refine the answer but stay strictly within the (budgeted) context"""
+        return self.prompt_builder.question_prompt(question, search_context)
+    
+    async def _generate_answer(self, question: str, search_context: str, cache_kind: str) -> str:
+        """Generate and cache an answer, falling back to the raw context on error"""
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            prompt = self._question_prompt(question, search_context)
+        
         try:
-            access_token = await self.get_google_access_token()
-            if not access_token:
-                return "Unable to authenticate with Google Cloud"
+            response = await self.generate(
+                prompt, flight_key=self._answer_flight_key(cache_kind, question, search_context)
+            )
+            answer = self._clean_answer(response.text.strip())
+        except Exception as e:
+            logger.error("Error generating answer: %s", e, extra={"question": question})
+            return search_context  # Use the raw search result
+        
+        await self._cache_answer(cache_kind, question, answer)
+        return answer
+    
+    @timed(OPERATION_SECONDS, operation="answer_question")
+    async def answer_question(self, question: str, document_index: Optional[DocumentIndex] = None) -> str:
+        """Answer a single question using ONLY the given document or your trained Discovery Engine data"""
+        started = time.perf_counter()
+        try:
+            logger.debug("Processing question", extra={"question": question})
             
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
+            cache_kind = self._question_cache_kind(document_index)
+            cached = await self._cached_answer(cache_kind, question)
+            if cached is not None:
+                logger.debug("Answer cache hit")
+                return cached
             
-            payload = {
-                "query": query,
-                "pageSize": 5,  # Reduced to get more focused results
-                "queryExpansionSpec": {"condition": "AUTO"},
-                "spellCorrectionSpec": {"mode": "AUTO"},
-                "languageCode": "en-US",
-                "contentSearchSpec": {
-                    "extractiveContentSpec": {
-                        "maxExtractiveAnswerCount": 3,
-                        "maxExtractiveSegmentCount": 1,
-                        "returnExtractiveSegmentScore": True
-                    },
-                    "summarySpec": {
-                        "summaryResultCount": 3,
-                        "includeCitations": True
-                    }
-                },
-                "userInfo": {"timeZone": "Asia/Calcutta"}
-            }
+            with STAGE_SECONDS.time(stage="retrieval"):
+                search_context, route = await self._question_context(question, document_index, started)
             
-            print(f"🔍 Searching Discovery Engine with query: '{query}'")
-            print(f"📡 Discovery Engine payload: {payload}")
+            if route is not None and route.direct:
+                logger.debug("Answered from search result", extra={"route": route.tier})
+                await self._cache_answer(cache_kind, question, route.answer)
+                self._finish_route(route)
+                return route.answer
             
-            response = requests.post(
-                self.discovery_endpoint,
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
+            # Only provide answers if we have relevant content from your knowledge base
+            if not self._has_context(search_context):
+                return NO_INFORMATION_ANSWER
             
-            print(f"📥 Discovery Engine response status: {response.status_code}")
-            print(f"📥 Discovery Engine response: {response.text[:500]}...")
+            answer = await self._generate_answer(question, search_context, cache_kind)
+            self._finish_route(route)
+            return answer
             
-            if response.status_code == 200:
-                result = response.json()
-                print(f"✅ Discovery Engine result structure: {list(result.keys())}")
-                
-                # Extract the most relevant content from your trained data
-                if 'results' in result and result['results']:
-                    print(f"📊 Found {len(result['results'])} results")
-                    
-                    # Try to get summary first (most relevant)
-                    if 'summary' in result and result['summary'].get('summaryText'):
-                        summary_text = result['summary']['summaryText']
-                        print(f"🎯 Using summary: {summary_text[:100]}...")
-                        return summary_text
-                    
-                    # Get extractive answers from your documents
-                    for result_item in result['results']:
-                        document = result_item.get('document', {})
-                        
-                        # Check for extractive answers
-                        if 'extractiveAnswers' in document and document['extractiveAnswers']:
-                            extractive_answer = document['extractiveAnswers'][0].get('content', '')
-                            if extractive_answer.strip():
-                                print(f"🎯 Using extractive answer: {extractive_answer[:100]}...")
-                                return extractive_answer
-                        
-                        # Check derived structure data
-                        if 'derivedStructData' in document:
-                            derived_data = document['derivedStructData']
-                            
-                            # Try extractive answers from derived data
-                            if 'extractive_answers' in derived_data and derived_data['extractive_answers']:
-                                answer = derived_data['extractive_answers'][0].get('content', '')
-                                if answer.strip():
-                                    print(f"🎯 Using derived extractive answer: {answer[:100]}...")
-                                    return answer
-                            
-                            # Try snippets as fallback
-                            if 'snippets' in derived_data and derived_data['snippets']:
-                                snippet = derived_data['snippets'][0].get('snippet', '')
-                                if snippet.strip():
-                                    print(f"🎯 Using snippet: {snippet[:100]}...")
-                                    return snippet
-                        
-                        # Try struct data as last resort
-                        if 'structData' in document and document['structData']:
-                            struct_data = document['structData']
-                            if isinstance(struct_data, dict):
-                                # Look for common content fields
-                                for field in ['content', 'text', 'description', 'body']:
-                                    if field in struct_data and struct_data[field]:
-                                        content = str(struct_data[field])
-                                        if content.strip():
-                                            print(f"🎯 Using struct data {field}: {content[:100]}...")
-                                            return content
-                
-                print("⚠️ No relevant information found in your knowledge base.")
-                return "I couldn't find specific information about this in the knowledge base. Please ensure your question relates to the uploaded documents."
-            else:
-                print(f"❌ Discovery Engine API error: {response.status_code} - {response.text}")
-                return f"Search service error: {response.status_code}"
-                
+        except UpstreamError as e:
+            # Never let an upstream failure reach Gemini as if it were context
+            logger.warning("Knowledge base search failed (%s)", e.reason, extra={"question": question})
+            return SEARCH_UNAVAILABLE_ANSWER
         except Exception as e:
-            print(f"Error searching Discovery Engine: {str(e)}")
-            return f"Search error: {str(e)}"
+            logger.error("Error processing question: %s", e, extra={"question": question})
+            return f"Error processing question: {str(e)}"
+    
+    async def _answer_batch(self, items: List[tuple], cache_kind: str) -> dict:
+        """Answer several (index, question, context) items with one JSON-mode Gemini call"""
+        # Each question's context is budgeted on its own; identical contexts still dedupe
+        prompt = build_batch_prompt([
+            (index, question, self.prompt_builder.compress(question, context))
+            for index, question, context in items
+        ])
+        try:
+            response = await self.generate(
+                prompt, generation_config={"response_mime_type": "application/json"}
+            )
+            parsed = parse_batch_answers(response.text, [index for index, _, _ in items])
+        except Exception as e:
+            logger.warning("Batched generation failed, falling back per question: %s", e)
+            parsed = {}
+        
+        self.batch_stats["batches"] += 1
+        self.batch_stats["batched_answers"] += len(parsed)
+        answers = {}
+        for index, question, _ in items:
+            if index in parsed:
+                answers[index] = self._clean_answer(parsed[index])
+                await self._cache_answer(cache_kind, question, answers[index])
+        return answers
+    
+    async def _answer_questions_batched(self, questions: List[str],
+                                        document_index: Optional[DocumentIndex]) -> List[str]:
+        """Retrieve context per question, then generate answers in a few batched prompts"""
+        started = time.perf_counter()
+        cache_kind = self._question_cache_kind(document_index)
+        answers: List[Optional[str]] = [None] * len(questions)
+        contexts = {}
+        routes = {}
+        semaphore = asyncio.Semaphore(self.question_concurrency)
+        
+        async def prepare(index: int, question: str):
+            async with semaphore:
+                try:
+                    cached = await self._cached_answer(cache_kind, question)
+                    if cached is not None:
+                        answers[index] = cached
+                        return
+                    search_context, route = await self._question_context(question, document_index, started)
+                    if route is not None and route.direct:
+                        answers[index] = route.answer
+                        await self._cache_answer(cache_kind, question, route.answer)
+                        self._finish_route(route)
+                        return
+                    if route is not None:
+                        routes[index] = route
+                    if self._has_context(search_context):
+                        contexts[index] = search_context
+                    else:
+                        answers[index] = NO_INFORMATION_ANSWER
+                except UpstreamError as e:
+                    logger.warning("Knowledge base search failed (%s)", e.reason, extra={"question": question})
+                    answers[index] = SEARCH_UNAVAILABLE_ANSWER
+                except Exception as e:
+                    logger.error("Error processing question: %s", e, extra={"question": question})
+                    answers[index] = f"Error processing question: {str(e)}"
+        
+        await asyncio.gather(*[prepare(i, q) for i, q in enumerate(questions)])
+        
+        pending = sorted(contexts)
+        batches = [
+            [(i, questions[i], contexts[i]) for i in pending[start:start + self.batch_size]]
+            for start in range(0, len(pending), self.batch_size)
+        ]
+        for batch_answers in await asyncio.gather(*[self._answer_batch(b, cache_kind) for b in batches]):
+            for index, answer in batch_answers.items():
+                answers[index] = answer
+        
+        # Questions missing from (or malformed in) the batched output are answered one by one
+        missing = [i for i in pending if answers[i] is None]
+        if missing:
+            self.batch_stats["fallbacks"] += len(missing)
+            logger.warning("%d question(s) missing from batched output, generating individually", len(missing))
+            
+            async def fallback(index: int) -> str:
+                async with semaphore:
+                    return await self._generate_answer(questions[index], contexts[index], cache_kind)
+            
+            for index, answer in zip(missing, await asyncio.gather(*[fallback(i) for i in missing])):
+                answers[index] = answer
+        
+        for route in routes.values():
+            self._finish_route(route)
+        return answers
     
+    @timed(OPERATION_SECONDS, operation="answer_questions")
     async def answer_questions(self, document_url: str, questions: List[str]) -> List[str]:
-        """Process questions using ONLY your trained Discovery Engine data"""
+        """Process questions concurrently, returning answers in the original order
+        
+        When document_url is an http(s) URL the document is fetched and indexed locally
+        (once per document) and used as the context instead of Discovery Engine.
+        With HACKRX_BATCH_GENERATION enabled, answers come from batched JSON prompts.
+        """
+        document_index = await self.load_document_index(document_url)
+        
+        if self.batch_generation and len(questions) > 1:
+            return await self._answer_questions_batched(questions, document_index)
+        
+        # A failing question only fails its own answer (answer_question never raises)
+        semaphore = asyncio.Semaphore(self.question_concurrency)
+        
+        async def bounded_answer(question: str) -> str:
+            async with semaphore:
+                return await self.answer_question(question, document_index)
+        
+        return list(await asyncio.gather(*[bounded_answer(q) for q in questions]))
+    
+    async def iter_answers(self, document_url: str, questions: List[str]) -> AsyncIterator[Tuple[int, str]]:
+        """Like answer_questions, but yields (index, answer) as soon as each answer is ready
+        
+        Only question_concurrency questions are in flight at once and answers are not
+        kept after they are yielded. Closing the iterator early cancels the rest.
+        Batched generation answers everything together, so it yields once all are done.
+        """
+        document_index = await self.load_document_index(document_url)
+        
+        if self.batch_generation and len(questions) > 1:
+            answers = await self._answer_questions_batched(questions, document_index)
+            for index, answer in enumerate(answers):
+                yield index, answer
+            return
+        
+        ready: asyncio.Queue = asyncio.Queue()
+        pending = iter(enumerate(questions))
+        
+        async def worker():
+            # Pulls the next question itself, so the number of tasks stays bounded
+            for index, question in pending:
+                await ready.put((index, await self.answer_question(question, document_index)))
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(self.question_concurrency, len(questions)))]
         try:
-            answers = []
+            for _ in range(len(questions)):
+                yield await ready.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    def _chat_prompt(self, message: str, search_context: str, history: str = "") -> str:
+        """Generate response using Gemini but stay within the (budgeted) knowledge base context"""
+        return self.prompt_builder.chat_prompt(message, search_context, history)
+    
+    @staticmethod
+    def _has_context(search_context: str) -> bool:
+        """Only respond if we have relevant content from your knowledge base"""
+        return bool(search_context and search_context.strip()) and \
+            search_context != NO_MATCH_CONTEXT
+    
+    async def _chat_session(self, session_id: Optional[str]) -> Optional[ChatSession]:
+        if not session_id or self.chat_sessions is None:
+            return None
+        return await self.chat_sessions.get(session_id)
+    
+    async def _prepare_chat(self, message: str, session: Optional[ChatSession],
+                            started: float) -> Tuple[Optional[str], Optional[str], Optional[Route], Optional[str]]:
+        """Everything before generation: (answer, None, route, None) when Gemini is not needed,
+        otherwise (None, prompt, route, flight_key); flight_key is None for prompts with history
+        
+        A follow-up on the session's current topic reuses the previous turn's passages
+        instead of searching again. Answers that depend on earlier turns are not cached.
+        """
+        stateless = session is None or not session.has_history
+        if stateless:
+            cached = await self._cached_answer("chat", message)
+            if cached is not None:
+                logger.debug("Answer cache hit")
+                return cached, None, None, None
+        
+        plan, query = (SEARCH, message) if session is None else self.chat_sessions.retrieval_plan(session, message)
+        route = None
+        with STAGE_SECONDS.time(stage="retrieval"):
+            if plan == REUSE:
+                search_context = session.context
+            else:
+                result = await self.search_discovery_engine(query)
+                search_context = self._search_context(result)
+                if plan == SEARCH:
+                    route = self._route(message, result, started)
+        logger.debug("Knowledge base context", extra={"retrieval": plan, "preview": search_context[:200]})
+        
+        if not self._has_context(search_context):
+            # No relevant content found in knowledge base
+            return CHAT_NO_MATCH_RESPONSE, None, None, None
+        if session is not None:
+            session.topic, session.context = query, search_context
+        if route is not None and route.direct:
+            if stateless:
+                await self._cache_answer("chat", message, route.answer)
+            return route.answer, None, route, None
+        
+        with STAGE_SECONDS.time(stage="prompt_build"):
+            history = history_text(session, self.session_history_token_budget) if not stateless else ""
+            prompt = self._chat_prompt(message, search_context, history)
+        flight_key = self._answer_flight_key("chat", message, search_context) if stateless else None
+        return None, prompt, route, flight_key
+    
+    async def _record_turn(self, session: Optional[ChatSession], message: str, response: str):
+        """Add the turn to its session and fold older turns into the summary when due"""
+        if session is None:
+            return
+        await self.chat_sessions.record_turn(session, message, response)
+        # Fold in batches so the summary costs one Gemini call every few turns, not every turn
+        if len(session.turns) >= 2 * self.session_recent_turns and not session.summarizing:
+            session.summarizing = True
+            task = asyncio.create_task(self._summarize_session(session))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+    
+    async def _summarize_session(self, session: ChatSession):
+        # Runs after the response is sent, so it must not inherit the request's deadline
+        deadline.set_deadline(None)
+        try:
+            older = session.turns[:-self.session_recent_turns]
+            budget = self.session_summary_token_budget
+            try:
+                response = await self.generate(SUMMARY_TEMPLATE.format(
+                    words=budget * 3 // 4, summary=session.summary or "(none)", turns=format_turns(older)
+                ))
+                summary = response.text.strip()
+                if not summary or estimate_tokens(summary) > 2 * budget:
+                    raise ValueError("summary missing or over budget")
+                self.chat_sessions.summaries += 1
+            except Exception as e:
+                logger.warning("Could not summarize chat session, folding turns instead: %s", e)
+                summary = fold_turns(session.summary, older, budget)
+                self.chat_sessions.summary_failures += 1
+            session.summary = summary
+            # Turns added while the summary was generated stay in place
+            del session.turns[:len(older)]
+            await self.chat_sessions.save(session)
+        finally:
+            session.summarizing = False
+    
+    @timed(OPERATION_SECONDS, operation="chat_response")
+    async def chat_response(self, message: str, session_id: Optional[str] = None) -> str:
+        """Generate a chat response using ONLY your Discovery Engine knowledge base
+        
+        With a session_id, earlier turns of that session inform the answer.
+        """
+        started = time.perf_counter()
+        try:
+            logger.debug("Processing chat message", extra={"chat_message": message})
             
-            for question in questions:
-                print(f"🔍 Processing question: {question}")
-                
-                # Search your Discovery Engine for relevant context
-                search_context = await self.search_discovery_engine(question)
-                
-                # Only provide answers if we have relevant content from your knowledge base
-                if search_context and search_context.strip() and \
-                   not search_context.startswith("I couldn't find specific information"):
-                    
-                    # Use Gemini to refine the answer but stay strictly within the context
-                    prompt = f"""
-                    You are an AI assistant that ONLY answers based on the provided context from a specific knowledge base.
-                    
-                    STRICT INSTRUCTIONS:
-                    1. Answer ONLY using information from the context below
-                    2. If the context doesn't contain enough information, say "The knowledge base doesn't contain enough information to answer this question"
-                    3. Do NOT add general knowledge or assumptions
-                    4. Keep answers concise and directly related to the context
-                    
-                    Context from Knowledge Base:
-                    {search_context}
-                    
-                    Question: {question}
-                    
-                    Answer based STRICTLY on the context above:
-                    """
-                    
-                    try:
-                        response = self.model.generate_content(prompt)
-                        answer = response.text.strip()
-                        
-                        # Validate that the answer seems to be based on the context
-                        if "knowledge base doesn't contain" in answer.lower() or \
-                           "don't have information" in answer.lower():
-                            answers.append("The knowledge base doesn't contain specific information to answer this question.")
-                        else:
-                            answers.append(answer)
-                            
-                    except Exception as e:
-                        print(f"Error generating answer for question '{question}': {str(e)}")
-                        answers.append(search_context)  # Use the raw search result
-                else:
-                    # No relevant content found in your knowledge base
-                    answers.append("The knowledge base doesn't contain specific information to answer this question.")
+            session = await self._chat_session(session_id)
+            stateless = session is None or not session.has_history
+            answer, prompt, route, flight_key = await self._prepare_chat(message, session, started)
+            
+            if prompt is not None:
+                logger.debug("Sending prompt to Gemini", extra={"prompt_chars": len(prompt)})
+                response = await self.generate(prompt, flight_key=flight_key)
+                answer = response.text.strip()
                 
-                # Small delay to avoid rate limiting
-                await asyncio.sleep(0.1)
+                logger.debug("Generated final response", extra={"preview": answer[:200]})
+                if stateless:
+                    await self._cache_answer("chat", message, answer)
             
-            return answers
+            self._finish_route(route)
+            await self._record_turn(session, message, answer)
+            return answer
             
+        except UpstreamError as e:
+            logger.warning("Knowledge base search failed (%s)", e.reason)
+            return CHAT_UNAVAILABLE_RESPONSE
         except Exception as e:
-            print(f"Error in answer_questions: {str(e)}")
-            return [f"Error processing questions: {str(e)}"] * len(questions)
+            logger.error("Error generating chat response: %s", e)
+            return CHAT_ERROR_RESPONSE
     
-    async def chat_response(self, message: str) -> str:
-        """Generate a chat response using ONLY your Discovery Engine knowledge base"""
+    async def chat_stream(self, message: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream a chat response chunk by chunk as Gemini generates it
+        
+        Failures are raised, not yielded, so the caller can tell them apart from the
+        answer (see chat_error_message for the text to show).
+        """
+        started = time.perf_counter()
         try:
-            print(f"💬 Processing chat message: '{message}'")
+            logger.debug("Streaming chat message", extra={"chat_message": message})
             
-            # Search your knowledge base for relevant context
-            search_context = await self.search_discovery_engine(message)
-            print(f"🔍 Knowledge base context: {search_context[:200]}...")
+            session = await self._chat_session(session_id)
+            stateless = session is None or not session.has_history
+            answer, prompt, route, _ = await self._prepare_chat(message, session, started)
+            if prompt is None:
+                self._finish_route(route)
+                await self._record_turn(session, message, answer)
+                yield answer
+                return
             
-            # Only respond if we have relevant content from your knowledge base
-            if search_context and search_context.strip() and \
-               not search_context.startswith("I couldn't find specific information"):
-                
-                # Generate response using Gemini but stay within the knowledge base context
-                prompt = f"""
-                You are a helpful AI assistant that answers ONLY based on a specific knowledge base.
-                
-                STRICT INSTRUCTIONS:
-                1. Answer ONLY using information from the context below
-                2. If the context doesn't fully answer the question, say "I can only provide information based on the knowledge base. Here's what I found:" and then provide what's available
-                3. Do NOT add general knowledge or make assumptions beyond the context
-                4. Be helpful but stay within the boundaries of the provided context
-                
-                Context from Knowledge Base:
-                {search_context}
-                
-                User Message: {message}
-                
-                Response based STRICTLY on the context above:
-                """
-                
-                print(f"🧠 Sending prompt to Gemini (length: {len(prompt)} characters)")
-                
-                response = self.model.generate_content(prompt)
-                final_response = response.text.strip()
-                
-                print(f"✅ Generated final response: {final_response[:200]}...")
-                return final_response
-            else:
-                # No relevant content found in knowledge base
-                return "I can only provide information based on the specific knowledge base I have access to. Your question doesn't match any content in the knowledge base. Please ask questions related to the uploaded documents or try rephrasing your question."
+            chunks = []
+            async for text in self._stream_generate(prompt):
+                chunks.append(text)
+                yield text
             
+            answer = "".join(chunks).strip()
+            if stateless:
+                await self._cache_answer("chat", message, answer)
+            self._finish_route(route)
+            await self._record_turn(session, message, answer)
+            
+        except UpstreamError as e:
+            logger.warning("Chat stream failed upstream (%s)", e.reason)
+            raise
         except Exception as e:
-            print(f"❌ Error generating chat response: {str(e)}")
-            return "I'm sorry, I encountered an error while searching the knowledge base. Please try again."
+            logger.error("Error streaming chat response: %s", e)
+            raise
+    
+    @staticmethod
+    def chat_error_message(error: Exception) -> str:
+        """What to tell the user when a chat answer failed with `error`"""
+        return CHAT_UNAVAILABLE_RESPONSE if isinstance(error, UpstreamError) else CHAT_ERROR_RESPONSE
@@ -0,0 +1,123 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional
+
+_STREAM_END = object()
+
+
+class GenerationRunner:
+    """Runs blocking Gemini calls on a dedicated, bounded thread pool"""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="gemini"
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Counters exposed through stats()
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.total_generation_ms = 0.0
+
+    async def _acquire_slot(self):
+        queued_at = time.perf_counter()
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        wait_ms = (time.perf_counter() - queued_at) * 1000
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.in_flight += 1
+
+    def _release_slot(self, started: float):
+        self.calls += 1
+        self.total_generation_ms += (time.perf_counter() - started) * 1000
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Wait for a free slot, then run func(*args, **kwargs) off the event loop"""
+        await self._acquire_slot()
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._release_slot(started)
+
+    async def stream(self, func: Callable, *args, **kwargs) -> AsyncIterator:
+        """Like run(), but func returns a blocking iterator whose items are yielded as they arrive"""
+        await self._acquire_slot()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in func(*args, **kwargs):
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+
+        loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    self.errors += 1
+                    raise item
+                yield item
+        finally:
+            # Stop the worker thread early if the consumer went away
+            stop.set()
+            self._release_slot(started)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_wait_ms": round(self.total_wait_ms / self.calls, 2) if self.calls else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "avg_generation_ms": round(self.total_generation_ms / self.calls, 2) if self.calls else 0.0,
+        }
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """True for Gemini quota (429) and unavailable (503) errors"""
+    return getattr(error, "code", None) in (429, 503) or \
+        type(error).__name__ in ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable")
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    """Read the server-suggested delay from a RetryInfo detail, if present"""
+    for detail in getattr(error, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
@@ -0,0 +1,94 @@
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class HedgePolicy:
+    """Decides when to send a duplicate (hedged) request and how many may be sent
+
+    A hedge fires once the first request has been outstanding for longer than
+    `percentile` of recent latencies. Hedges are capped at `budget_ratio` of all
+    requests so a slow upstream is not hit with twice the load.
+    """
+
+    def __init__(self, percentile: float = 95, budget_ratio: float = 0.05,
+                 default_delay: float = 1.0, min_delay: float = 0.05,
+                 min_samples: int = 20, window: int = 512):
+        self.percentile = min(max(percentile, 0.0), 100.0)
+        self.budget_ratio = budget_ratio
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+
+        # Counters exposed through stats()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def observe(self, seconds: float):
+        self._latencies.append(seconds)
+
+    def delay(self) -> float:
+        """Seconds to wait for the first request before hedging"""
+        if len(self._latencies) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def has_budget(self) -> bool:
+        # One hedge of headroom so a cold service can still hedge its first slow call
+        if self.hedges < self.budget_ratio * self.requests + 1:
+            return True
+        self.budget_denied += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            "current_delay_ms": round(self.delay() * 1000, 2),
+        }
+
+
+async def hedged(call: Callable[[], Awaitable[T]], policy: HedgePolicy,
+                 can_hedge: Callable[[], bool] = lambda: True) -> T:
+    """Run call(), adding one duplicate if it is slow; the first success wins
+
+    can_hedge() is consulted just before the duplicate is sent (e.g. to take a
+    rate-limit token without waiting). The losing request is cancelled.
+    """
+    policy.requests += 1
+    started = time.monotonic()
+    primary = asyncio.ensure_future(call())
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=policy.delay())
+        if not done and policy.has_budget() and can_hedge():
+            policy.hedges += 1
+            tasks.add(asyncio.ensure_future(call()))
+
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            failed = None
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        policy.hedge_wins += 1
+                    policy.observe(time.monotonic() - started)
+                    return task.result()
+                failed = task
+            # Only give up once every outstanding request has failed
+            if not tasks:
+                return failed.result()
+    finally:
+        for task in tasks:
+            task.cancel()
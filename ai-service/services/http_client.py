@@ -0,0 +1,49 @@
+import os
+import logging
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClientConfig:
+    """Connection pool and timeout settings for upstream HTTP calls"""
+
+    def __init__(self):
+        self.http2 = os.getenv("DISCOVERY_HTTP2", "True").lower() == "true"
+        self.max_connections = int(os.getenv("DISCOVERY_HTTP_MAX_CONNECTIONS", 100))
+        self.max_keepalive_connections = int(os.getenv("DISCOVERY_HTTP_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(os.getenv("DISCOVERY_HTTP_KEEPALIVE_EXPIRY", 30))
+        self.connect_timeout = float(os.getenv("DISCOVERY_HTTP_CONNECT_TIMEOUT", 5))
+        self.read_timeout = float(os.getenv("DISCOVERY_HTTP_READ_TIMEOUT", 20))
+        self.write_timeout = float(os.getenv("DISCOVERY_HTTP_WRITE_TIMEOUT", 5))
+        self.pool_timeout = float(os.getenv("DISCOVERY_HTTP_POOL_TIMEOUT", 5))
+        # Upper bound for a whole request, including time spent waiting on the pool
+        self.total_timeout = float(os.getenv("DISCOVERY_HTTP_TOTAL_TIMEOUT", 30))
+
+
+def create_http_client(config: HttpClientConfig = None) -> httpx.AsyncClient:
+    """Create a keep-alive AsyncClient shared by all upstream calls"""
+    config = config or HttpClientConfig()
+
+    http2 = config.http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("h2 is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry
+        ),
+        timeout=httpx.Timeout(
+            connect=config.connect_timeout,
+            read=config.read_timeout,
+            write=config.write_timeout,
+            pool=config.pool_timeout
+        )
+    )
@@ -0,0 +1,354 @@
+import json
+import math
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+from services.logging_config import request_id_var
+from services.admission import BACKGROUND
+from services.errors import AdmissionRejectedError
+from services.metrics import ADMISSION_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+_COLUMNS = ("id", "status", "documents", "questions", "answers", "error",
+            "created_at", "updated_at", "expires_at")
+
+
+class SQLiteJobStore:
+    """Keeps jobs in a local SQLite file so they survive a worker restart"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, documents TEXT NOT NULL, "
+                "questions TEXT NOT NULL, answers TEXT NOT NULL, error TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL, expires_at REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _to_job(row) -> dict:
+        job = dict(zip(_COLUMNS, row))
+        job["questions"] = json.loads(job["questions"])
+        job["answers"] = json.loads(job["answers"])
+        return job
+
+    def save(self, job: dict):
+        values = [job[column] for column in _COLUMNS]
+        values[3] = json.dumps(job["questions"])
+        values[4] = json.dumps(job["answers"])
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                values
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_job(row) if row else None
+
+    def unfinished(self, stale_before: float) -> List[dict]:
+        """Queued or running jobs nobody has touched since stale_before"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status IN (?, ?) AND updated_at < ? "
+                "ORDER BY created_at",
+                (QUEUED, RUNNING, stale_before)
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def claim(self, job_id: str, now: float, stale_before: Optional[float] = None) -> bool:
+        """Atomically mark a job running; False if another worker process got it first
+
+        Without stale_before only a queued job can be claimed; with it, a job whose
+        owner stopped updating it (e.g. a crashed worker) can be taken over.
+        """
+        with self._lock:
+            if stale_before is None:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (RUNNING, now, job_id, QUEUED)
+                )
+            else:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status IN (?, ?) "
+                    "AND updated_at < ?",
+                    (RUNNING, now, job_id, QUEUED, RUNNING, stale_before)
+                )
+            self._conn.commit()
+        return cursor.rowcount == 1
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+            ).rowcount
+            self._conn.commit()
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobManager:
+    """Answers large question sets in the background for POST /jobs
+
+    A fixed number of workers take queued jobs in order; each job answers its
+    questions with the service's usual per-request concurrency and saves every
+    answer as it arrives, so polling sees partial results. With an admission
+    controller, a worker waits for background capacity before claiming a job (it
+    stays 'queued' meanwhile), each job holding an equal share of it so `workers`
+    jobs fit. At most `max_pending` jobs wait for a worker; further submissions
+    are shed with a 429. Finished jobs are kept for `result_ttl` seconds. Unfinished jobs found in the store at start-up are
+    resumed, skipping questions that were already answered.
+
+    Several worker processes may share one store: a job is claimed atomically
+    before it runs, and running jobs are touched every lease/3 seconds. At start-up
+    every unfinished job not touched since `started_at` (when the server, i.e. all
+    of its worker processes, started) is resumed at once; after that the store is
+    rescanned every lease/3 seconds for jobs idle longer than `lease_seconds`, e.g.
+    because the worker process running them died.
+    """
+
+    def __init__(self, service, store: Optional[SQLiteJobStore] = None, workers: int = 2,
+                 result_ttl: float = 86400.0, max_questions: int = 500, lease_seconds: float = 60.0,
+                 admission=None, started_at: Optional[float] = None, max_pending: Optional[int] = 100):
+        self.service = service
+        self.store = store
+        self.workers = max(1, workers)
+        self.result_ttl = result_ttl
+        self.max_questions = max_questions
+        self.lease_seconds = lease_seconds
+        # None = accept every submission
+        self.max_pending = max_pending
+        # Optional AdmissionController: jobs run as lowest-priority (background) traffic
+        self.admission = admission
+        # Questions answered at once per job, which is also the admission units it holds
+        self.job_concurrency = service.question_concurrency
+        if admission is not None:
+            share = admission.classes[BACKGROUND].max_units // self.workers
+            self.job_concurrency = max(1, min(self.job_concurrency, share))
+        # Jobs last touched before this belong to a previous run of the server
+        self.started_at = started_at
+        # Job ID -> updated_at cutoff it may be taken over with, for jobs found in the store
+        self._resumed: Dict[str, float] = {}
+
+        # Jobs being worked on (or waiting), plus all jobs when there is no store
+        self._jobs: Dict[str, dict] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        # Counters exposed through stats()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.resumed = 0
+        self.rejected = 0
+        # Moving average of how long a job runs, for Retry-After estimates
+        self._avg_job_seconds = 60.0
+
+    async def _save(self, job: dict):
+        job["updated_at"] = time.time()
+        if self.store is not None:
+            await asyncio.to_thread(self.store.save, job)
+
+    async def start(self):
+        """Start the workers and requeue jobs left unfinished by a previous process"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.store is not None:
+            await asyncio.to_thread(self.store.purge_expired, time.time())
+            now = time.time()
+            started_at = self.started_at if self.started_at is not None else now
+            await self._recover(max(started_at, now - self.lease_seconds))
+            self._tasks.append(asyncio.create_task(self._recover_periodically()))
+
+    async def _recover(self, stale_before: float):
+        """Queue unfinished jobs in the store not touched since stale_before"""
+        resumed = 0
+        for job in await asyncio.to_thread(self.store.unfinished, stale_before):
+            if job["id"] in self._jobs:
+                continue
+            self._jobs[job["id"]] = job
+            self._resumed[job["id"]] = stale_before
+            self._queue.put_nowait(job["id"])
+            resumed += 1
+        if resumed:
+            self.resumed += resumed
+            logger.info("Resuming %d unfinished job(s)", resumed)
+
+    async def _recover_periodically(self):
+        # Picks up jobs whose worker process died after this one started
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self._recover(time.time() - self.lease_seconds)
+            except Exception as e:
+                logger.warning("Job recovery scan failed: %s", e)
+
+    async def stop(self):
+        """Stop the workers; running jobs stay 'running' in the store and resume on restart"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self.store is not None:
+            self.store.close()
+
+    async def submit(self, documents: str, questions: List[str]) -> dict:
+        if len(questions) > self.max_questions:
+            raise ValueError(f"A job can have at most {self.max_questions} questions")
+        await self.start()
+        if self.max_pending is not None and self._queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            ADMISSION_REJECTIONS.inc(priority_class=BACKGROUND, reason="queue_full")
+            raise AdmissionRejectedError(BACKGROUND, "queue_full", 429, self._retry_after())
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "documents": documents,
+            "questions": list(questions),
+            "answers": [None] * len(questions),
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": None,
+        }
+        self._jobs[job["id"]] = job
+        await self._save(job)
+        self._queue.put_nowait(job["id"])
+        self.submitted += 1
+        return job
+
+    def _retry_after(self) -> float:
+        """Rough time until a worker frees up for one more job, in whole seconds"""
+        waiting = self._queue.qsize() + 1
+        return float(max(1, math.ceil(self._avg_job_seconds * waiting / self.workers)))
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        # The store is the source of truth: the job may be running in another worker process
+        if self.store is not None:
+            job = await asyncio.to_thread(self.store.get, job_id)
+        else:
+            job = self._jobs.get(job_id)
+        if job is None or (job["expires_at"] is not None and job["expires_at"] <= time.time()):
+            return None
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            token = request_id_var.set(f"job-{job_id}")
+            try:
+                # Claimed (marked running) only once capacity is granted
+                async with (self.admission.slot(BACKGROUND, self.job_concurrency)
+                            if self.admission else nullcontext()):
+                    if await self._claim(job):
+                        await self._run(job)
+                    else:
+                        logger.info("Job already claimed by another worker")
+            finally:
+                request_id_var.reset(token)
+                self._resumed.pop(job_id, None)
+                if self.store is not None and job["status"] != RUNNING:
+                    # The store has the final result; keep memory bounded by active jobs
+                    self._jobs.pop(job_id, None)
+
+    async def _claim(self, job: dict) -> bool:
+        now = time.time()
+        if self.store is not None:
+            stale_before = self._resumed.get(job["id"])
+            if not await asyncio.to_thread(self.store.claim, job["id"], now, stale_before):
+                job["status"] = None
+                return False
+        job["status"] = RUNNING
+        job["updated_at"] = now
+        return True
+
+    async def _heartbeat(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await self._save(job)
+
+    async def _run(self, job: dict):
+        heartbeat = asyncio.create_task(self._heartbeat(job)) if self.store is not None else None
+        started = time.monotonic()
+        try:
+            document_index = await self.service.load_document_index(job["documents"])
+            semaphore = asyncio.Semaphore(self.job_concurrency)
+
+            async def answer(index: int, question: str):
+                async with semaphore:
+                    job["answers"][index] = await self.service.answer_question(question, document_index)
+                await self._save(job)
+
+            await asyncio.gather(*[
+                answer(index, question) for index, question in enumerate(job["questions"])
+                if job["answers"][index] is None
+            ])
+            job["status"] = COMPLETED
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Job failed: %s", e)
+            job["status"] = FAILED
+            job["error"] = str(e)
+            self.failed += 1
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            self._avg_job_seconds = 0.9 * self._avg_job_seconds + 0.1 * (time.monotonic() - started)
+        job["expires_at"] = time.time() + self.result_ttl
+        await self._save(job)
+        if self.store is None:
+            self._purge_memory()
+
+    def _purge_memory(self):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["expires_at"] is not None and job["expires_at"] <= now]:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "job_concurrency": self.job_concurrency,
+            "backend": "sqlite" if self.store is not None else None,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "active": sum(1 for job in self._jobs.values() if job["status"] == RUNNING),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "resumed": self.resumed,
+            "rejected": self.rejected,
+        }
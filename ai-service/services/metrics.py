@@ -0,0 +1,214 @@
+import time
+import bisect
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Latency buckets in seconds, from cache hits up to slow generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: LabelKey, extra: LabelKey = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., sum, count]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(key, (('le', _format_value(float(bound))),))} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {series[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}"
+            yield f"{self.name}_count{_format_labels(key)} {series[-1]}"
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], Dict[str, dict]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, collector: Callable[[], Dict[str, dict]]):
+        """Export numeric fields of component stats() dicts as gauges at scrape time"""
+        self._collectors.append(collector)
+
+    def _collect_stats(self) -> Iterable[str]:
+        for collector in self._collectors:
+            for component, stats in collector().items():
+                if not stats:
+                    continue
+                for field, value in stats.items():
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if not isinstance(value, (int, float)) or value == float("inf"):
+                        continue
+                    name = f"ai_service_{component}_{field}"
+                    yield f"# TYPE {name} gauge"
+                    yield f"{name} {_format_value(value)}"
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        lines.extend(self._collect_stats())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "ai_service_http_requests_total", "HTTP requests by route, method and status"
+))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ai_service_http_request_duration_seconds", "HTTP request latency by route"
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ai_service_http_requests_in_flight", "HTTP requests currently being served"
+))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ai_service_stage_duration_seconds", "Latency of each pipeline stage"
+))
+OPERATION_SECONDS = REGISTRY.register(Histogram(
+    "ai_service_operation_duration_seconds", "End-to-end latency of service operations"
+))
+UPSTREAM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ai_service_upstream_in_flight", "Upstream calls currently in flight"
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "ai_service_upstream_errors_total", "Upstream errors by upstream and reason"
+))
+
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "ai_service_prompt_tokens", "Estimated tokens per Gemini prompt",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+))
+
+ANSWER_ROUTE_SECONDS = REGISTRY.register(Histogram(
+    "ai_service_answer_route_duration_seconds", "End-to-end answer latency by route (direct tier or gemini)"
+))
+
+ADMISSION_QUEUED = REGISTRY.register(Gauge(
+    "ai_service_admission_queued", "Requests waiting for admission by priority class"
+))
+ADMISSION_IN_USE = REGISTRY.register(Gauge(
+    "ai_service_admission_units_in_use", "Admitted capacity units in use by priority class"
+))
+ADMISSION_REJECTIONS = REGISTRY.register(Counter(
+    "ai_service_admission_rejections_total", "Requests shed by priority class and reason"
+))
+ADMISSION_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "ai_service_admission_wait_seconds", "Time admitted requests waited in their queue by priority class"
+))
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator recording an async function's latency in histogram"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
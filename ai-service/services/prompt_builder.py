@@ -0,0 +1,195 @@
+import re
+from typing import List, Tuple
+import numpy as np
+
+from services.semantic_cache import HashingVectorizer, tokenize
+
+_PASSAGE_BREAK = re.compile(r"\n\s*\n")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Shared by the single-question and batched prompts so the two cannot drift apart
+ANSWER_RULES = """1. Use only information in the context
+2. If the context is not enough, say "The knowledge base doesn't contain enough information to answer this question"
+3. Do NOT add general knowledge or assumptions
+4. Be concise and stay on the context"""
+
+QUESTION_TEMPLATE = """Answer ONLY from the knowledge base context below.
+Rules:
+""" + ANSWER_RULES + """
+
+Context:
+{context}
+
+Question: {question}
+Answer:"""
+
+# {{ }} survive the first format() (filling in the rules) as literal JSON braces
+BATCH_TEMPLATE = """Answer each question ONLY from the knowledge base context it refers to.
+Rules:
+""" + ANSWER_RULES + """
+5. Reply with JSON only: {{"answers": [{{"index": <question number>, "answer": "<answer>"}}]}}
+
+Contexts:
+{contexts}
+
+Questions:
+{questions}"""
+
+CHAT_TEMPLATE = """You are a helpful assistant that answers ONLY from the knowledge base context below.
+Rules:
+1. Use only information in the context
+2. If the context doesn't fully answer the message, say "I can only provide information based on the knowledge base. Here's what I found:" and give what is available
+3. Do NOT add general knowledge or assumptions
+4. Be helpful but stay within the context
+
+Context:
+{context}
+
+User message: {message}
+Response:"""
+
+SESSION_CHAT_TEMPLATE = """You are a helpful assistant that answers ONLY from the knowledge base context below.
+Rules:
+1. Use only information in the context; the conversation only tells you what the user means
+2. If the context doesn't fully answer the message, say "I can only provide information based on the knowledge base. Here's what I found:" and give what is available
+3. Do NOT add general knowledge or assumptions
+4. Be helpful but stay within the context
+
+Conversation so far:
+{history}
+
+Context:
+{context}
+
+User message: {message}
+Response:"""
+
+SUMMARY_TEMPLATE = """Update the running summary of a conversation with the new turns below.
+Keep the topics, facts and user details a later answer may need. Write at most {words} words of plain text.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count: about four characters per token"""
+    return (len(text) + 3) // 4
+
+
+def split_passages(context: str) -> List[str]:
+    return [passage.strip() for passage in _PASSAGE_BREAK.split(context) if passage.strip()]
+
+
+def split_sentences(passage: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_END.split(passage) if sentence.strip()]
+
+
+class PromptBuilder:
+    """Fits retrieved context into a token budget before it is templated into a prompt
+
+    Near-duplicate passages are dropped; if the rest is still over budget, only the
+    sentences sharing the most terms with the query are kept, in their original order.
+    """
+
+    def __init__(self, context_token_budget: int, duplicate_threshold: float = 0.9, dim: int = 512):
+        self.context_token_budget = context_token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.vectorizer = HashingVectorizer(dim)
+
+        # Counters exposed through stats()
+        self.prompts = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.context_tokens_in = 0
+        self.context_tokens_out = 0
+        self.duplicates_dropped = 0
+        self.sentences_dropped = 0
+
+    def _deduplicate(self, passages: List[str]) -> List[str]:
+        kept, vectors = [], []
+        for passage in passages:
+            vector = self.vectorizer.embed(passage)
+            if vectors and float(np.max(np.stack(vectors) @ vector)) >= self.duplicate_threshold:
+                self.duplicates_dropped += 1
+                continue
+            kept.append(passage)
+            vectors.append(vector)
+        return kept
+
+    def _select_sentences(self, query: str, passages: List[str]) -> str:
+        query_terms = set(tokenize(query))
+        sentences: List[Tuple[int, int, str, int]] = []
+        for p, passage in enumerate(passages):
+            for s, sentence in enumerate(split_sentences(passage)):
+                sentences.append((p, s, sentence, len(query_terms.intersection(tokenize(sentence)))))
+
+        # Most query terms first; earlier (higher ranked) passages and sentences break ties
+        ranked = sorted(sentences, key=lambda item: (-item[3], item[0], item[1]))
+        chosen, used = [], 0
+        for item in ranked:
+            cost = estimate_tokens(item[2]) + 1
+            if used + cost <= self.context_token_budget:
+                chosen.append(item)
+                used += cost
+        self.sentences_dropped += len(sentences) - len(chosen)
+        if not chosen and ranked:
+            # Even the best sentence is over budget: keep a truncated prefix of it
+            return ranked[0][2][:self.context_token_budget * 4]
+
+        blocks, current, current_passage = [], [], None
+        for p, _, sentence, _ in sorted(chosen, key=lambda item: (item[0], item[1])):
+            if p != current_passage and current:
+                blocks.append(" ".join(current))
+                current = []
+            current_passage = p
+            current.append(sentence)
+        if current:
+            blocks.append(" ".join(current))
+        return "\n\n".join(blocks)
+
+    def compress(self, query: str, context: str) -> str:
+        """Deduplicated context, trimmed to the most query-relevant sentences if over budget"""
+        self.context_tokens_in += estimate_tokens(context)
+        passages = self._deduplicate(split_passages(context))
+        compressed = "\n\n".join(passages)
+        if self.context_token_budget > 0 and estimate_tokens(compressed) > self.context_token_budget:
+            compressed = self._select_sentences(query, passages)
+        self.context_tokens_out += estimate_tokens(compressed)
+        return compressed
+
+    def record(self, prompt: str) -> int:
+        """Count a finished prompt's estimated tokens and return them"""
+        tokens = estimate_tokens(prompt)
+        self.prompts += 1
+        self.prompt_tokens += tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+        return tokens
+
+    def question_prompt(self, question: str, context: str) -> str:
+        return QUESTION_TEMPLATE.format(context=self.compress(question, context), question=question)
+
+    def chat_prompt(self, message: str, context: str, history: str = "") -> str:
+        if history:
+            return SESSION_CHAT_TEMPLATE.format(
+                history=history, context=self.compress(message, context), message=message
+            )
+        return CHAT_TEMPLATE.format(context=self.compress(message, context), message=message)
+
+    def stats(self) -> dict:
+        return {
+            "context_token_budget": self.context_token_budget,
+            "prompts": self.prompts,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "context_tokens_in": self.context_tokens_in,
+            "context_tokens_out": self.context_tokens_out,
+            "context_reduction": round(1 - self.context_tokens_out / self.context_tokens_in, 4)
+            if self.context_tokens_in else 0.0,
+            "duplicates_dropped": self.duplicates_dropped,
+            "sentences_dropped": self.sentences_dropped,
+        }
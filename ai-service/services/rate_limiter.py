@@ -0,0 +1,123 @@
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+# Upstream statuses that mean "slow down and try again"
+RETRYABLE_STATUS_CODES = {429, 503}
+
+
+class TokenBucket:
+    """Async token bucket; a rate of 0 or less disables limiting"""
+
+    def __init__(self, rate_per_second: float, capacity: float = None):
+        self.rate = rate_per_second
+        self.capacity = capacity if capacity is not None else max(rate_per_second, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        # Waiters queue on the lock so they are served in arrival order
+        self._lock = asyncio.Lock()
+
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait_ms = 0.0
+
+    @classmethod
+    def per_minute(cls, rate_per_minute: float, capacity: float = None):
+        # Per-minute quotas allow bursts of up to ten seconds' worth of budget
+        if capacity is None:
+            capacity = max(rate_per_minute / 6.0, 1.0)
+        return cls(rate_per_minute / 60.0, capacity)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens, sleeping until they are available; returns seconds waited"""
+        if not self.enabled:
+            return 0.0
+
+        # Requests larger than the bucket would never fit, so cap them
+        tokens = min(tokens, self.capacity)
+        started = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        if waited > 0.001:
+            self.throttled += 1
+            self.total_wait_ms += waited * 1000
+        return waited
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens only if they are available now and nobody is waiting"""
+        if not self.enabled:
+            return True
+        if self._lock.locked():
+            return False
+        self._refill()
+        tokens = min(tokens, self.capacity)
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        self.acquired += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "rate_per_second": round(self.rate, 3),
+            "capacity": self.capacity,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "total_wait_ms": round(self.total_wait_ms, 2),
+        }
+
+
+class BackoffPolicy:
+    """Exponential backoff with full jitter, capped and Retry-After aware"""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number attempt + 1"""
+        self.retries += 1
+        jittered = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            # Never retry earlier than the upstream asked us to
+            return max(retry_after, jittered)
+        return jittered
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
@@ -0,0 +1,162 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from services import deadline
+from services.search_result import SearchResult
+
+logger = logging.getLogger(__name__)
+
+
+class SearchResultCache:
+    """Bounded LRU of parsed search results with stale-while-revalidate
+
+    An entry is fresh for `ttl_seconds`. For `stale_seconds` after that it is still
+    served, while one background search refreshes it; older entries are searched
+    again inline, so a result is never more than ttl + stale seconds old.
+
+    invalidate() drops every entry. When `invalidation_path` is set it also touches
+    that file, and every process sharing the path clears its own entries on its next
+    lookup (checked at most once per `check_interval` seconds).
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, stale_seconds: float,
+                 invalidation_path: Optional[str] = None, check_interval: float = 1.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.invalidation_path = invalidation_path
+        self.check_interval = check_interval
+        # key -> (result, fetched_at)
+        self._entries: "OrderedDict[str, Tuple[SearchResult, float]]" = OrderedDict()
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        # Bumped by invalidate() so searches started before it are not stored
+        self._generation = 0
+        self._invalidated_at = self._marker_mtime() or 0.0
+        self._next_check = 0.0
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _marker_mtime(self) -> Optional[float]:
+        if not self.invalidation_path:
+            return None
+        try:
+            return os.stat(self.invalidation_path).st_mtime
+        except OSError:
+            return None
+
+    def _check_invalidation(self, now: float):
+        """Pick up an invalidation made by another process sharing the marker file"""
+        if not self.invalidation_path or now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        mtime = self._marker_mtime()
+        if mtime is not None and mtime > self._invalidated_at:
+            self._invalidated_at = mtime
+            self._clear()
+
+    def _clear(self) -> int:
+        dropped = len(self._entries)
+        self._entries.clear()
+        for task in self._refreshing.values():
+            task.cancel()
+        self._refreshing.clear()
+        self._generation += 1
+        self.invalidations += 1
+        return dropped
+
+    def _store(self, key: str, result: SearchResult, generation: int):
+        if generation != self._generation:
+            return
+        self._entries[key] = (result, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _refresh(self, key: str, fetch: Callable[[], Awaitable[SearchResult]], generation: int):
+        # A background refresh must not inherit the deadline of the request that triggered it
+        deadline.set_deadline(None)
+        try:
+            self._store(key, await fetch(), generation)
+            self.refreshes += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Keep serving the stale entry until it ages out
+            self.refresh_failures += 1
+            logger.warning("Background search refresh failed: %s", e)
+        finally:
+            if self._refreshing.get(key) is asyncio.current_task():
+                del self._refreshing[key]
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[SearchResult]]) -> SearchResult:
+        """The cached result for key, calling fetch() when it is missing or too old"""
+        now = time.time()
+        self._check_invalidation(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, fetched_at = entry
+            age = now - fetched_at
+            if age <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            if age <= self.ttl_seconds + self.stale_seconds:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.create_task(self._refresh(key, fetch, self._generation))
+                return result
+            del self._entries[key]
+
+        self.misses += 1
+        generation = self._generation
+        result = await fetch()
+        self._store(key, result, generation)
+        return result
+
+    def invalidate(self) -> int:
+        """Drop every cached result (in all processes sharing the marker file); returns the local count"""
+        if self.invalidation_path:
+            with open(self.invalidation_path, "a"):
+                os.utime(self.invalidation_path)
+            self._invalidated_at = self._marker_mtime() or time.time()
+        dropped = self._clear()
+        logger.info("Search cache invalidated", extra={"dropped": dropped})
+        return dropped
+
+    async def close(self):
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._refreshing.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshing": len(self._refreshing),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,157 @@
+import re
+import json
+from typing import List, Tuple
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser gives the same result, just slower
+    _loads = json.loads
+
+_HIGHLIGHT_TAGS = re.compile(r"</?b>")
+_STRUCT_FIELDS = ("content", "text", "description", "body")
+
+
+class Passage:
+    """One piece of retrieved text, ranked by the result it came from"""
+
+    __slots__ = ("text", "score", "document_id", "kind", "rank")
+
+    def __init__(self, text: str, score: float, document_id: str, kind: str, rank: int):
+        self.text = text
+        self.score = score
+        self.document_id = document_id
+        self.kind = kind
+        self.rank = rank
+
+    def __repr__(self):
+        return f"Passage({self.kind}, rank={self.rank}, score={self.score:.3f}, {self.text[:40]!r})"
+
+
+class Citation:
+    """A span of the summary and the documents that support it"""
+
+    __slots__ = ("start", "end", "document_ids")
+
+    def __init__(self, start: int, end: int, document_ids: Tuple[str, ...]):
+        self.start = start
+        self.end = end
+        self.document_ids = document_ids
+
+    def __repr__(self):
+        return f"Citation({self.start}-{self.end}, {self.document_ids})"
+
+
+class SearchResult:
+    """Compact form of a Discovery Engine search response"""
+
+    __slots__ = ("summary", "passages", "citations")
+
+    def __init__(self, summary: str = "", passages: List[Passage] = None, citations: List[Citation] = None):
+        self.summary = summary
+        self.passages = passages or []
+        self.citations = citations or []
+
+    def __bool__(self):
+        return bool(self.summary or self.passages)
+
+    @property
+    def document_ids(self) -> List[str]:
+        seen = {}
+        for passage in self.passages:
+            seen.setdefault(passage.document_id, None)
+        return list(seen)
+
+    def top_passages(self, limit: int) -> List[Passage]:
+        return self.passages[:max(0, limit)]
+
+    def context(self, max_passages: int) -> str:
+        """The summary followed by up to max_passages distinct top passages"""
+        blocks = [self.summary] if self.summary else []
+        for passage in self.top_passages(max_passages):
+            if passage.text not in blocks:
+                blocks.append(passage.text)
+        return "\n\n".join(blocks)
+
+
+def _document_id(item: dict, document: dict) -> str:
+    document_id = document.get("id") or item.get("id")
+    if document_id:
+        return document_id
+    # Fall back to the last segment of the resource name
+    return (document.get("name") or "").rsplit("/", 1)[-1]
+
+
+def _item_passages(item: dict, rank: int) -> List[Passage]:
+    """Passages of one result, best kind first: answers, segments, snippets, struct data"""
+    document = item.get("document") or {}
+    document_id = _document_id(item, document)
+    rank_score = 1.0 / (rank + 1)
+    derived = document.get("derivedStructData") or {}
+    passages = []
+
+    def add(text, kind, score=None):
+        if isinstance(text, str):
+            text = text.strip()
+            if text:
+                passages.append(Passage(text, rank_score if score is None else float(score), document_id, kind, rank))
+
+    for answer in document.get("extractiveAnswers") or derived.get("extractive_answers") or ():
+        add(answer.get("content"), "extractive_answer")
+    for segment in derived.get("extractive_segments") or ():
+        add(segment.get("content"), "extractive_segment", segment.get("relevanceScore"))
+    for snippet in derived.get("snippets") or ():
+        status = snippet.get("snippet_status")
+        if status is None or status == "SUCCESS":
+            add(_HIGHLIGHT_TAGS.sub("", snippet.get("snippet") or ""), "snippet")
+
+    if not passages:
+        struct_data = document.get("structData")
+        if isinstance(struct_data, dict):
+            for field in _STRUCT_FIELDS:
+                value = struct_data.get(field)
+                if value:
+                    add(str(value), "struct_data")
+                    break
+    return passages
+
+
+def _citations(summary: dict) -> List[Citation]:
+    metadata = summary.get("summaryWithMetadata") or {}
+    references = [
+        (reference.get("document") or "").rsplit("/", 1)[-1]
+        for reference in metadata.get("references") or ()
+    ]
+    citations = []
+    for citation in (metadata.get("citationMetadata") or {}).get("citations") or ():
+        document_ids = []
+        for source in citation.get("sources") or ():
+            index = int(source.get("referenceIndex", 0))
+            if 0 <= index < len(references) and references[index]:
+                document_ids.append(references[index])
+        citations.append(Citation(
+            int(citation.get("startIndex", 0)), int(citation.get("endIndex", 0)), tuple(document_ids)
+        ))
+    return citations
+
+
+def parse_search_response(body) -> SearchResult:
+    """Decode a search response body (bytes or str) into a SearchResult
+
+    Only the fields the service uses are copied out; the decoded JSON tree is
+    dropped as soon as this returns.
+    """
+    data = _loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Search response is not a JSON object")
+
+    passages = []
+    for rank, item in enumerate(data.get("results") or ()):
+        passages.extend(_item_passages(item, rank))
+
+    summary = data.get("summary") or {}
+    summary_text = summary.get("summaryText") or (summary.get("summaryWithMetadata") or {}).get("summary") or ""
+    # Without any results the summary is only a "no results" notice
+    if not passages and not data.get("results"):
+        summary_text = ""
+    return SearchResult(summary_text.strip(), passages, _citations(summary))
@@ -0,0 +1,145 @@
+import re
+import time
+import zlib
+from typing import FrozenSet, List, Optional, Tuple
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an the is are was were be of for to in on at by with and or what whats how long does do "
+    "i my me you your it this that there which who can could would should will please tell about".split()
+)
+
+
+def _stem(word: str) -> str:
+    """Very light suffix stripping so 'premiums' and 'premium' share features"""
+    for suffix in ("ing", "ies", "es", "s", "ed"):
+        if len(word) > 4 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, stemmed content words with stopwords removed"""
+    return [_stem(token) for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+# Single capital letters after a word ("Plan A", "Schedule B") name different things
+_LETTER_IDENTIFIER = re.compile(r"(?<=\w )[A-Z]\b")
+
+
+def key_terms(text: str) -> FrozenSet[str]:
+    """Content words, numbers and letter identifiers that must match for two questions to be the same"""
+    return frozenset(tokenize(text)) | frozenset("#" + letter for letter in _LETTER_IDENTIFIER.findall(text))
+
+
+class HashingVectorizer:
+    """Embeds text as a signed, hashed bag of words plus character trigrams
+
+    Runs on the CPU with no model download; crc32 keeps vectors stable across processes.
+    """
+
+    def __init__(self, dim: int = 2048):
+        self.dim = dim
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float):
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % self.dim] += weight if h & 0x80000000 else -weight
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in tokenize(text):
+            self._add(vector, "w:" + word, 1.0)
+            padded = f"<{word}>"
+            for i in range(len(padded) - 2):
+                self._add(vector, "c:" + padded[i:i + 3], 0.5)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Reuses answers for reworded questions via cosine similarity on a NumPy index
+
+    Hashed bag-of-words similarity is high for questions that differ in one
+    decisive word ("Plan A" vs "Plan B"), so a match must also have exactly the
+    same key terms; the embedding only finds the candidates.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_seconds: float, dim: int = 2048):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.vectorizer = HashingVectorizer(dim)
+
+        # Fixed-size slots; expired or least recently used slots are overwritten first
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._expires_at = np.zeros(self.max_entries, dtype=np.float64)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._namespaces = np.full(self.max_entries, -1, dtype=np.int32)
+        self._answers = [None] * self.max_entries
+        self._terms: List[Optional[FrozenSet[str]]] = [None] * self.max_entries
+        self._namespace_ids = {}
+
+        # Counters exposed through stats()
+        self.hits = 0
+        self.misses = 0
+        # Candidates above the threshold turned down because their key terms differ
+        self.term_mismatches = 0
+        self.evictions = 0
+        self.total_lookup_ms = 0.0
+
+    def _namespace_id(self, namespace: str) -> int:
+        return self._namespace_ids.setdefault(namespace, len(self._namespace_ids))
+
+    def lookup(self, namespace: str, text: str) -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) for the nearest live entry above the threshold"""
+        started = time.perf_counter()
+        try:
+            namespace_id = self._namespace_ids.get(namespace)
+            if namespace_id is not None:
+                now = time.time()
+                scores = self._vectors @ self.vectorizer.embed(text)
+                live = (self._namespaces == namespace_id) & (self._expires_at > now)
+                scores[~live] = -1.0
+                terms = key_terms(text)
+                candidates = np.flatnonzero(scores >= self.threshold)
+                for best in candidates[np.argsort(-scores[candidates])]:
+                    if self._terms[best] != terms:
+                        self.term_mismatches += 1
+                        continue
+                    self._last_used[best] = now
+                    self.hits += 1
+                    return self._answers[best], float(scores[best])
+            self.misses += 1
+            return None
+        finally:
+            self.total_lookup_ms += (time.perf_counter() - started) * 1000
+
+    def add(self, namespace: str, text: str, answer: str):
+        now = time.time()
+        expired = np.flatnonzero(self._expires_at <= now)
+        if expired.size:
+            slot = int(expired[0])
+        else:
+            slot = int(np.argmin(self._last_used))
+            self.evictions += 1
+        self._vectors[slot] = self.vectorizer.embed(text)
+        self._expires_at[slot] = now + self.ttl_seconds
+        self._last_used[slot] = now
+        self._namespaces[slot] = self._namespace_id(namespace)
+        self._answers[slot] = answer
+        self._terms[slot] = key_terms(text)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "threshold": self.threshold,
+            "entries": int(np.count_nonzero(self._expires_at > time.time())),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "term_mismatches": self.term_mismatches,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_lookup_ms": round(self.total_lookup_ms / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from services import deadline
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one shared upstream call
+
+    The shared call budgets against the latest deadline of the callers waiting on
+    it, so a caller with a longer budget is not failed by a leader's shorter one.
+    Each caller still bounds its own wait with its own deadline.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._deadlines: Dict[str, deadline.SharedDeadline] = {}
+
+        # Counters exposed through stats()
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run func() once per key at a time; concurrent callers await the same result"""
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            shared = deadline.SharedDeadline(deadline.current())
+            # A task (not the caller's coroutine) owns the work, so one caller
+            # being cancelled does not cancel it for everyone else
+            task = asyncio.ensure_future(self._run(shared, func))
+            self._inflight[key] = task
+            self._deadlines[key] = shared
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+            self._deadlines[key].extend(deadline.current())
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def _run(shared: deadline.SharedDeadline, func: Callable[[], Awaitable[Any]]) -> Any:
+        # Only this task's context sees the shared deadline
+        deadline.use_shared(shared)
+        return await func()
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        self._deadlines.pop(key, None)
+        # Mark the error as retrieved; every caller may have stopped waiting (e.g. on a deadline)
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+import google.auth
+from google.auth.transport.requests import Request
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+
+class GoogleTokenManager:
+    """Builds Google Cloud credentials once and keeps their access token fresh"""
+
+    def __init__(self, project_id: str, refresh_margin: float = None):
+        self.project_id = project_id
+        self.refresh_margin = refresh_margin if refresh_margin is not None else \
+            float(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", 300))
+
+        self._credentials = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        # Counters exposed through stats()
+        self.refresh_count = 0
+        self.refresh_failures = 0
+        self.total_refresh_ms = 0.0
+        self.last_refresh_ms = 0.0
+        self.cache_hits = 0
+        self.blocking_fetches = 0
+
+    def _build_credentials(self):
+        """Create credentials from env vars, a key file or ADC (in that order)"""
+        # Option 1: Try environment variables first (for Render deployment)
+        if os.getenv("GOOGLE_SERVICE_ACCOUNT_EMAIL") and os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY"):
+            from google.oauth2 import service_account
+
+            service_account_info = {
+                "type": "service_account",
+                "project_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_PROJECT_ID", self.project_id),
+                "private_key_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY_ID", ""),
+                "private_key": os.getenv("GOOGLE_SERVICE_ACCOUNT_PRIVATE_KEY").replace('\\n', '\n'),
+                "client_email": os.getenv("GOOGLE_SERVICE_ACCOUNT_EMAIL"),
+                "client_id": os.getenv("GOOGLE_SERVICE_ACCOUNT_CLIENT_ID", ""),
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+                "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{os.getenv('GOOGLE_SERVICE_ACCOUNT_EMAIL')}"
+            }
+
+            credentials = service_account.Credentials.from_service_account_info(
+                service_account_info,
+                scopes=SCOPES
+            )
+            logger.info("Using service account credentials from environment variables",
+                        extra={"service_account_project": service_account_info['project_id']})
+
+            # Use the service account's project ID for Discovery Engine
+            self.project_id = service_account_info['project_id']
+            return credentials
+
+        # Option 2: Try service account key file
+        if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+            service_account_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+            if os.path.exists(service_account_path):
+                from google.oauth2 import service_account
+                credentials = service_account.Credentials.from_service_account_file(
+                    service_account_path,
+                    scopes=SCOPES
+                )
+                logger.info("Using service account credentials from file")
+                return credentials
+            return None
+
+        # Option 3: Try default credentials (ADC)
+        credentials, project = google.auth.default(scopes=SCOPES)
+        logger.info("Using default application credentials")
+        return credentials
+
+    def _seconds_until_stale(self) -> float:
+        """Seconds left before the cached token enters the refresh margin"""
+        if not self._credentials or not self._credentials.token:
+            return 0.0
+        expiry = self._credentials.expiry
+        if expiry is None:
+            # Credentials without an expiry never need refreshing
+            return float("inf")
+        remaining = (expiry - datetime.utcnow()).total_seconds()
+        return remaining - self.refresh_margin
+
+    def _has_fresh_token(self) -> bool:
+        return self._seconds_until_stale() > 0
+
+    async def _refresh(self):
+        """Refresh the token off the event loop; caller must hold the lock"""
+        if self._credentials is None:
+            self._credentials = await asyncio.to_thread(self._build_credentials)
+            if self._credentials is None:
+                raise Exception("No valid credentials found")
+
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._credentials.refresh, Request())
+        except Exception:
+            self.refresh_failures += 1
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.refresh_count += 1
+        self.total_refresh_ms += elapsed_ms
+        self.last_refresh_ms = elapsed_ms
+        logger.info("Refreshed Google access token", extra={"refresh_ms": round(elapsed_ms, 1)})
+
+    async def get_token(self) -> str:
+        """Return a cached access token, refreshing it only when it is stale"""
+        self._ensure_refresh_task()
+
+        if self._has_fresh_token():
+            self.cache_hits += 1
+            return self._credentials.token
+
+        self.blocking_fetches += 1
+        async with self._lock:
+            # Another request may have refreshed while we waited for the lock
+            if not self._has_fresh_token():
+                await self._refresh()
+            return self._credentials.token
+
+    def _ensure_refresh_task(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        """Refresh the token ahead of expiry so requests never wait on auth"""
+        while True:
+            delay = self._seconds_until_stale()
+            if delay == float("inf"):
+                return
+            await asyncio.sleep(max(delay, 0))
+            try:
+                async with self._lock:
+                    if not self._has_fresh_token():
+                        await self._refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Background token refresh failed: %s", e)
+                await asyncio.sleep(min(30, max(self.refresh_margin / 10, 1)))
+
+    async def start(self):
+        """Fetch the first token and start the background refresher"""
+        await self.get_token()
+
+    async def stop(self):
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+        self._refresh_task = None
+
+    def stats(self) -> dict:
+        return {
+            "refresh_count": self.refresh_count,
+            "refresh_failures": self.refresh_failures,
+            "last_refresh_ms": round(self.last_refresh_ms, 2),
+            "avg_refresh_ms": round(self.total_refresh_ms / self.refresh_count, 2) if self.refresh_count else 0.0,
+            "cache_hits": self.cache_hits,
+            "blocking_fetches": self.blocking_fetches,
+            "token_ttl_seconds": round(self._seconds_until_stale() + self.refresh_margin, 1)
+            if self._credentials and self._credentials.token and self._credentials.expiry else None,
+        }
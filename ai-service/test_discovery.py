@@ -44,7 +44,7 @@ async def test_discovery_engine():
         for query in test_queries:
             print(f"\n📝 Query: {query}")
             result = await service.search_discovery_engine(query)
-            print(f"📄 Result: {result[:200]}...")
+            print(f"📄 Result: {result.context(service.search_context_passages)[:200]}...")
         
         # Test complete Q&A
         print("\n🎯 Testing Complete Q&A Process...")
@@ -41,7 +41,7 @@ async def test_discovery_engine():
             # Test direct Discovery Engine search
             search_result = await service.search_discovery_engine(query)
             print(f"📄 Raw Discovery Result:")
-            print(f"   {search_result[:200]}...")
+            print(f"   {search_result.context(service.search_context_passages)[:200]}...")
             print()
             
             # Test processed answer
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Load test for /api/v1/chat against a local Discovery Engine stand-in
+Shows that concurrent chat requests overlap instead of queueing behind each other.
+No Google credentials or network access are needed.
+
+Usage: python test_load.py [concurrency] [search_latency_seconds]
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+STANDIN_PORT = int(os.getenv("STANDIN_PORT", 9100))
+SERVICE_PORT = int(os.getenv("LOAD_TEST_PORT", 9101))
+API_KEY = "load-test-key"
+
+# Point the service at the stand-in before it is imported
+os.environ.setdefault("GEMINI_API_KEY", "load-test")
+os.environ.setdefault("GOOGLE_PROJECT_ID", "load-test-project")
+os.environ.setdefault("DISCOVERY_ENGINE_ID", "load-test-engine")
+os.environ["DISCOVERY_ENDPOINT_URL"] = f"http://127.0.0.1:{STANDIN_PORT}/search"
+os.environ["API_SERVICE_KEY"] = API_KEY
+# Every request must reach the stand-in, so answer caches are off
+os.environ["ANSWER_CACHE_ENABLED"] = "False"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "False"
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+
+def create_discovery_standin(latency: float) -> FastAPI:
+    """Minimal Discovery Engine search endpoint with a fixed response time"""
+    standin = FastAPI()
+
+    @standin.post("/search")
+    async def search(payload: dict):
+        await asyncio.sleep(latency)
+        return {
+            "results": [{"id": "doc-1", "document": {"id": "doc-1"}}],
+            "summary": {"summaryText": f"The grace period for '{payload.get('query')}' is thirty days."}
+        }
+
+    return standin
+
+
+class FakeGeminiResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiModel:
+    """Returns instantly so the measurement isolates the search path"""
+
+    def generate_content(self, prompt, **kwargs):
+        return FakeGeminiResponse("The grace period is thirty days.")
+
+
+async def start_server(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def send_chat(client, i):
+    response = await client.post(
+        f"http://127.0.0.1:{SERVICE_PORT}/api/v1/chat",
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        json={"message": f"What is the grace period for premium payment? ({i})"}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def run_load_test(concurrency: int = 50, search_latency: float = 0.5):
+    print("🧪 Load testing /api/v1/chat against a local Discovery Engine stand-in")
+    print("=" * 50)
+
+    from main import app
+    from routes.api_routes import init_services
+    gemini_service = init_services()
+
+    async def local_token():
+        return "load-test-token"
+
+    gemini_service.token_manager.get_token = local_token
+    gemini_service.model = FakeGeminiModel()
+
+    standin, standin_task = await start_server(create_discovery_standin(search_latency), STANDIN_PORT)
+    service, service_task = await start_server(app, SERVICE_PORT)
+
+    try:
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+            # Warm up connections in both directions
+            await send_chat(client, -1)
+
+            started = time.perf_counter()
+            await send_chat(client, 0)
+            single = time.perf_counter() - started
+            print(f"1️⃣ Single request: {single:.2f}s")
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*[send_chat(client, i) for i in range(concurrency)])
+            total = time.perf_counter() - started
+            print(f"🚀 {len(results)} concurrent requests: {total:.2f}s")
+            print(f"📊 Serial time would be ~{single * concurrency:.2f}s")
+
+            # Overlapping requests finish in about the time of one, not the sum of all
+            passed = total < single * 3
+            print("✅ Requests ran concurrently" if passed else "❌ Requests were serialized")
+            return passed
+    finally:
+        service.should_exit = True
+        standin.should_exit = True
+        await asyncio.gather(service_task, standin_task)
+
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    ok = asyncio.run(run_load_test(concurrency, latency))
+    sys.exit(0 if ok else 1)